@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""ColorScope benchmarks"""
+
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import cv2
+import ip.batchreader
+import ip.colorfilter
+import ip.colorjson
+import ip.colormeter
+import ip.colorreader
+import ip.graph
+import ip.imgloader
+import ip.qualitymeasurement
+
+BENCH_IMG = 'res/test_img/cat.png'
+
+
+def per_pixel_filter(img, reduce_func):
+  h, w, num_channels = img.shape
+  channel_data = [[] for i in range(num_channels)]
+  for y in range(0, h):
+    for x in range(0, w):
+      channels = img[y, x, :]
+      for i in range(0, num_channels):
+        channel_data[i].append(int(channels[i]))
+  return [int(reduce_func(channel_val)) for channel_val in channel_data]
+
+
+def report(name, reference_time, bench_time):
+  print('{:<24}{:>10.2f} ms{:>10.2f} ms{:>10.1f}x'.format(
+      name, reference_time * 1000, bench_time * 1000, reference_time / bench_time))
+
+
+def bench_color_filter(repeat=3):
+  img = cv2.imread(BENCH_IMG)
+  filters = [
+      ('avg', ip.colorfilter.ColorChannelFilterAverage(), np.average),
+      ('med', ip.colorfilter.ColorChannelFilterMedian(), np.median)
+  ]
+  print('Color filter, full frame ROI', img.shape)
+  print('{:<24}{:>13}{:>13}{:>11}'.format('filter', 'per-pixel', 'numpy', 'speedup'))
+  for name, color_filter, reduce_func in filters:
+    if color_filter.filter(img) != per_pixel_filter(img, reduce_func):
+      raise AssertionError('Filter ' + name + ' result mismatch')
+    reference_time = min(timeit.repeat(
+        lambda func=reduce_func: per_pixel_filter(img, func), number=1, repeat=repeat))
+    bench_time = min(timeit.repeat(
+        lambda flt=color_filter: flt.filter(img), number=1, repeat=repeat))
+    report(name, reference_time, bench_time)
+
+
+def numpy_median(img):
+  return [int(val) for val in np.median(img.reshape(-1, img.shape[-1]), axis=0)]
+
+
+def bench_histogram_median(repeat=5):
+  rng = np.random.RandomState(0)
+  median_filter = ip.colorfilter.ColorChannelFilterMedian()
+  images = [('bench image', cv2.imread(BENCH_IMG)),
+            ('4k frame', rng.randint(0, 256, (2160, 3840, 3)).astype(np.uint8))]
+  print('Histogram median against np.median, full frame ROI')
+  for name, img in images:
+    if median_filter.filter(img) != numpy_median(img):
+      raise AssertionError('Histogram median result mismatch')
+    reference_time = min(timeit.repeat(
+        lambda img=img: numpy_median(img), number=1, repeat=repeat))
+    bench_time = min(timeit.repeat(
+        lambda img=img: median_filter.filter(img), number=1, repeat=repeat))
+    report(name, reference_time, bench_time)
+    print('{:<24}{:>10.1f} MB{:>10.1f} MB'.format(
+        'peak memory',
+        traced_peak(lambda img=img: numpy_median(img)) / 2**20,
+        traced_peak(lambda img=img: median_filter.filter(img)) / 2**20))
+
+
+def bench_color_reader_patches(num_patches=500, repeat=3):
+  img_loader = ip.imgloader.create(BENCH_IMG)
+  img = img_loader.imread()
+  h, w, _ = img.shape
+  rng = np.random.RandomState(0)
+  rects = [[[int(rng.randint(w)), int(rng.randint(h))],
+            [int(rng.randint(w)), int(rng.randint(h))]] for i in range(num_patches)]
+  rects = [rect for rect in rects if rect[0][0] != rect[1][0] and rect[0][1] != rect[1][1]]
+  color_filter = ip.colorfilter.ColorChannelFilterAverage()
+
+  def read_rects_direct():
+    for (x1, y1), (x2, y2) in rects:
+      roi = img[min(y1, y2):max(y1, y2), min(x1, x2):max(x1, x2)]
+      color_filter.filter(cv2.cvtColor(roi, cv2.COLOR_BGR2HLS))
+
+  def read_rects_integral():
+    color_reader = ip.colorreader.ColorReaderHLS(img_loader, 'bench.json')
+    for rect in rects:
+      color_reader.read_rect_color(rect)
+
+  print('Color reader,', len(rects), 'avg patches')
+  reference_time = min(timeit.repeat(read_rects_direct, number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(read_rects_integral, number=1, repeat=repeat))
+  report('integral image', reference_time, bench_time)
+
+
+def bench_batch_reader(num_images=200):
+  out_json_filename = 'bench_batch.json'
+  rois = [[[10, 10], [60, 60]], [[100, 200], [180, 260]], [[300, 500], [480, 720]]]
+  batch_reader = ip.batchreader.BatchReader('hls', 'avg', rois)
+  start = time.perf_counter()
+  batch_reader.read([BENCH_IMG] * num_images, out_json_filename)
+  elapsed = time.perf_counter() - start
+  os.remove(out_json_filename)
+  print('Batch reader,', num_images, 'images,', len(rois), 'rois:',
+        '{:.0f} images/min'.format(num_images * 60 / elapsed))
+
+
+def bench_color_reader_large_frame(size=(3000, 4000), repeat=3):
+  img = np.random.RandomState(0).randint(0, 256, size + (3,), dtype=np.uint8)
+  rects = [[[10, 10], [60, 60]], [[100, 200], [180, 260]], [[300, 500], [480, 720]]]
+  color_reader = ip.colorreader.ColorReaderHLS(ip.imgloader.create(BENCH_IMG), 'bench.json')
+
+  def read_rects_full_frame():
+    integral = ip.colorfilter.IntegralImage(cv2.cvtColor(img, cv2.COLOR_BGR2HLS))
+    return [integral.average(x1, y1, x2, y2) for (x1, y1), (x2, y2) in rects]
+
+  def read_rects_lazy():
+    color_reader.set_image(img)
+    return [color_reader.read_rect_color(rect) for rect in rects]
+
+  if read_rects_full_frame() != read_rects_lazy():
+    raise AssertionError('Large frame color reader result mismatch')
+  print('Color reader,', '{}x{}'.format(size[1], size[0]), 'frame,', len(rects), 'avg rois')
+  reference_time = min(timeit.repeat(read_rects_full_frame, number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(read_rects_lazy, number=1, repeat=repeat))
+  report('roi conversion', reference_time, bench_time)
+
+
+def float_mean_square_error(image_ref, image_cap):
+  i_mat = image_ref.astype(float)
+  k_mat = image_cap.astype(float)
+  return np.sum(np.square(i_mat - k_mat))/float(i_mat.shape[0]*i_mat.shape[1])/3.0
+
+
+def traced_peak(func):
+  tracemalloc.start()
+  func()
+  peak_bytes = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak_bytes
+
+
+def bench_psnr_kernel(size=(2160, 3840), repeat=3):
+  rng = np.random.RandomState(0)
+  image_ref = rng.randint(0, 256, size + (3,)).astype(np.uint8)
+  image_cap = rng.randint(0, 256, size + (3,)).astype(np.uint8)
+  kernel = ip.qualitymeasurement.SquareErrorKernel()
+  if abs(kernel.mean(image_ref, image_cap) - float_mean_square_error(image_ref, image_cap)) > 1e-6:
+    raise AssertionError('Square error kernel result mismatch')
+  print('PSNR mse kernel', image_ref.shape)
+  reference_time = min(timeit.repeat(
+      lambda: float_mean_square_error(image_ref, image_cap), number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(
+      lambda: kernel.mean(image_ref, image_cap), number=1, repeat=repeat))
+  report('row block int32', reference_time, bench_time)
+  print('{:<24}{:>10.1f} MB{:>10.1f} MB (kernel block {:.1f} MB)'.format(
+      'peak memory',
+      traced_peak(lambda: float_mean_square_error(image_ref, image_cap)) / 2**20,
+      traced_peak(lambda: kernel.mean(image_ref, image_cap)) / 2**20,
+      kernel.get_peak_bytes() / 2**20))
+
+
+def bench_ssim_tiled(size=(2160, 3840), tile_size=512, repeat=1):
+  rng = np.random.RandomState(0)
+  image_ref = rng.randint(0, 256, size + (3,)).astype(np.uint8)
+  image_cap = cv2.GaussianBlur(image_ref, (5, 5), 0)
+  ssim_measure = ip.qualitymeasurement.QualityMeasurementSSIM.measure
+  kernel = ip.qualitymeasurement.SSIMTiledKernel(tile_size)
+  if abs(kernel.mean(image_ref, image_cap) - ssim_measure(image_ref, image_cap)) > 1e-9:
+    raise AssertionError('Tiled ssim result mismatch')
+  print('SSIM tiles', tile_size, image_ref.shape)
+  reference_time = min(timeit.repeat(
+      lambda: ssim_measure(image_ref, image_cap), number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(
+      lambda: kernel.mean(image_ref, image_cap), number=1, repeat=repeat))
+  report('tiled ssim', reference_time, bench_time)
+  print('{:<24}{:>10.1f} MB{:>10.1f} MB'.format(
+      'peak memory',
+      traced_peak(lambda: ssim_measure(image_ref, image_cap)) / 2**20,
+      traced_peak(lambda: kernel.mean(image_ref, image_cap)) / 2**20))
+
+
+def per_element_delta_perc(ref_channels, cap_channels):
+  def delta_perc(ref, cap):
+    return 0 if ref == 0 else (cap * 100.0) / ref
+  return [np.average([delta_perc(ref, cap) for ref, cap in zip(ref_channels[i], cap_channels[i])])
+          for i in range(3)]
+
+
+def bench_color_meter(num_samples=2000000, repeat=3):
+  rng = np.random.RandomState(0)
+  ref = rng.randint(0, 256, (num_samples, 3)).astype(np.uint8)
+  cap = rng.randint(0, 256, (num_samples, 3)).astype(np.uint8)
+  ref_channels = [ref[:, i].tolist() for i in range(3)]
+  cap_channels = [cap[:, i].tolist() for i in range(3)]
+
+  def accumulate():
+    accumulator = ip.colormeter.HLSDeltaAccumulator()
+    accumulator.append(ref, cap)
+    return accumulator
+
+  if not np.allclose(per_element_delta_perc(ref_channels, cap_channels),
+                     accumulate().get_delta_perc_average()):
+    raise AssertionError('Color meter result mismatch')
+  print('Color meter,', num_samples, 'sample pairs')
+  reference_time = min(timeit.repeat(
+      lambda: per_element_delta_perc(ref_channels, cap_channels), number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(
+      lambda: accumulate().get_stats(), number=1, repeat=repeat))
+  report('delta perc + stats', reference_time, bench_time)
+
+
+def skimage_delta_e_map(image_ref, image_cap, method):
+  import skimage.color  # pylint: disable=import-outside-toplevel
+  functions = {'76': skimage.color.deltaE_cie76, '94': skimage.color.deltaE_ciede94,
+               '2000': skimage.color.deltaE_ciede2000}
+  return functions[method](skimage.color.rgb2lab(image_ref[..., ::-1]),
+                           skimage.color.rgb2lab(image_cap[..., ::-1]))
+
+
+def bench_delta_e_map(size=(2160, 3840), repeat=1):
+  rng = np.random.RandomState(0)
+  image_ref = rng.randint(0, 256, size + (3,)).astype(np.uint8)
+  image_cap = np.uint8(np.clip(image_ref + rng.randint(-20, 21, image_ref.shape), 0, 255))
+  band = slice(0, 64)
+  print('Delta E map', image_ref.shape)
+  for method in ['76', '94', '2000']:
+    if np.abs(ip.colormeter.get_delta_e_map(image_ref[band], image_cap[band], method) -
+              skimage_delta_e_map(image_ref[band], image_cap[band], method)).max() > 1e-2:
+      raise AssertionError('Delta E ' + method + ' result mismatch')
+    reference_time = min(timeit.repeat(
+        lambda method=method: skimage_delta_e_map(image_ref, image_cap, method),
+        number=1, repeat=repeat))
+    bench_time = min(timeit.repeat(
+        lambda method=method: ip.colormeter.get_delta_e_map(image_ref, image_cap, method),
+        number=1, repeat=repeat))
+    report('delta e ' + method, reference_time, bench_time)
+
+
+def per_pixel_hs_background():
+  img_hls = np.zeros((179, 255, 3), np.uint8)
+  for y in range(img_hls.shape[0]):
+    for x in range(img_hls.shape[1]):
+      img_hls[y, x] = [y, 127, x]
+  return cv2.cvtColor(img_hls, cv2.COLOR_BGR2RGB)
+
+
+def bench_hs_background(repeat=3):
+  if not np.array_equal(per_pixel_hs_background(), ip.graph.generate_hs_background()):
+    raise AssertionError('HS background result mismatch')
+  print('HS background')
+  reference_time = min(timeit.repeat(per_pixel_hs_background, number=1, repeat=repeat))
+  bench_time = min(timeit.repeat(ip.graph.generate_hs_background, number=1, repeat=repeat))
+  report('meshgrid', reference_time, bench_time)
+  ip.graph.get_hs_background()
+  bench_time = min(timeit.repeat(ip.graph.get_hs_background, number=1, repeat=repeat))
+  report('process cache', reference_time, bench_time)
+
+
+def per_sample_plot(axes, ref_points, cap_points):
+  for (p1_x, p1_y), (p2_x, p2_y) in zip(ref_points, cap_points):
+    axes.plot([p1_x, p2_x], [p1_y, p2_y], color='black', linewidth=0.7)
+    axes.plot([p1_x, p1_x], [p1_y, p1_y], 'bs-')
+    axes.plot([p2_x, p2_x], [p2_y, p2_y], 'ro-')
+
+
+def render_graph(draw):
+  # pylint: disable=import-outside-toplevel
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  figure = Figure()
+  canvas = FigureCanvasAgg(figure)
+  draw(figure.add_subplot(1, 1, 1))
+  canvas.draw()
+
+
+def bench_graph_samples(rng, num_samples, reference_max):
+  ref_filename, cap_filename = 'bench_graph_ref.cbin', 'bench_graph_cap.cbin'
+  for filename in [ref_filename, cap_filename]:
+    values = rng.randint(0, 179, (3, num_samples)).astype(np.uint8)
+    ip.colorjson.write_binary(filename, {
+        'format': 'hls', 'channels': dict(zip('hls', values))})
+  graph_hs = ip.graph.GraphHS(ref_filename, cap_filename)
+  ref_points = rng.randint(0, 179, (min(num_samples, reference_max), 2))
+  cap_points = rng.randint(0, 179, (min(num_samples, reference_max), 2))
+  reference_time = timeit.timeit(
+      lambda: render_graph(lambda axes: per_sample_plot(axes, ref_points, cap_points)),
+      number=1) * num_samples / len(ref_points)
+  bench_time = timeit.timeit(lambda: render_graph(graph_hs.draw), number=1)
+  report('{} samples'.format(num_samples), reference_time, bench_time)
+  os.remove(ref_filename)
+  os.remove(cap_filename)
+
+
+def bench_graph_render(sample_counts=(1000, 10000, 1000000), reference_max=1000):
+  rng = np.random.RandomState(0)
+  print('HS graph render, per sample plot extrapolated above', reference_max, 'samples')
+  for num_samples in sample_counts:
+    bench_graph_samples(rng, num_samples, reference_max)
+
+
+def export_new_figure(graphs_filenames):
+  # pylint: disable=import-outside-toplevel
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  for ref_json_filename, cap_json_filename, out_filename in graphs_filenames:
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ip.graph.GraphHS(ref_json_filename, cap_json_filename).draw(figure.add_subplot(1, 1, 1))
+    figure.savefig(out_filename)
+
+
+def bench_graph_export(num_graphs=32, num_samples=1000, jobs=4):
+  rng = np.random.RandomState(0)
+  json_filenames = ['bench_export_ref.cbin', 'bench_export_cap.cbin']
+  for filename in json_filenames:
+    values = rng.randint(0, 179, (3, num_samples)).astype(np.uint8)
+    ip.colorjson.write_binary(filename, {'format': 'hls', 'channels': dict(zip('hls', values))})
+  graphs_filenames = [json_filenames + ['bench_export_{}.png'.format(i)]
+                      for i in range(num_graphs)]
+  print('HS graph export,', num_graphs, 'graphs of', num_samples, 'samples')
+  reference_time = timeit.timeit(lambda: export_new_figure(graphs_filenames), number=1)
+  bench_time = timeit.timeit(lambda: ip.graph.export_graphs(graphs_filenames), number=1)
+  report('reused figure', reference_time, bench_time)
+  bench_time = timeit.timeit(lambda: ip.graph.export_graphs(graphs_filenames, jobs), number=1)
+  report('reused figure, jobs={}'.format(jobs), reference_time, bench_time)
+  for filename in json_filenames + [out[2] for out in graphs_filenames]:
+    os.remove(filename)
+
+
+HEAVY_MODULES = ['matplotlib', 'skimage', 'scipy']
+
+
+def bench_startup(repeat=5):
+  check_code = 'import sys, colorscope; sys.exit(any(m in sys.modules for m in {!r}))'
+  if subprocess.run([sys.executable, '-c', check_code.format(HEAVY_MODULES)],
+                    check=False).returncode != 0:
+    raise AssertionError('import colorscope loads one of ' + str(HEAVY_MODULES))
+
+  def startup(code):
+    return min(timeit.repeat(
+        lambda: subprocess.run([sys.executable, '-c', code], check=True), number=1, repeat=repeat))
+
+  print('CLI startup')
+  reference_time = startup('import colorscope, matplotlib.pyplot, skimage.measure')
+  bench_time = startup('import colorscope')
+  report('lazy imports', reference_time, bench_time)
+
+
+def main():
+  bench_startup()
+  bench_color_filter()
+  bench_histogram_median()
+  bench_color_reader_patches()
+  bench_batch_reader()
+  bench_color_reader_large_frame()
+  bench_color_meter()
+  bench_delta_e_map()
+  bench_hs_background()
+  bench_graph_render()
+  bench_graph_export()
+  bench_psnr_kernel()
+  bench_ssim_tiled()
+
+
+if __name__ == '__main__':
+  main()
@@ -2,15 +2,19 @@
 """Script to read the color values"""
 
 import argparse
+import json
 import sys
 import os
 import ip.imgloader
+import ip.batchreader
 import ip.colorjson
 import ip.colorreader
 import ip.graph
 import ip.qualitymeasurement
+import ip.server
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-statements
+# pylint: disable=too-many-branches
 
 def parse_video_size_arg(video_size):
   if video_size != '':
@@ -19,13 +23,54 @@ def parse_video_size_arg(video_size):
   return None
 
 
-def is_metric_name_correct(given_metrics):
-  list_of_metrics_names = ["ssim", "psnr"]
-  if given_metrics in list_of_metrics_names:
+def parse_frames_arg(frames):
+  if frames != '':
+    start, stop = frames.split(':', 1)
+    return slice(int(start) if start else None, int(stop) if stop else None)
+  return None
+
+
+def is_metric_name_correct(given_metrics, singlechannel=False):
+  list_of_metrics_names = ["ssim", "psnr", "mse", "ssim-tiled"]
+  if not singlechannel:
+    list_of_metrics_names += ["ssim-yuv", "psnr-yuv"]
+  metrics = given_metrics.split(',')
+  if all(metric in list_of_metrics_names for metric in metrics) and \
+     len(set(metrics)) == len(metrics):
     return True
   return False
 
-def process_mulitchannel_compare(multichannel_args):
+
+def process_compare(img_load_ref, img_load_cap, metric, suffix, *process_args):
+  metrics = metric.split(',')
+  measurement = ip.qualitymeasurement.QualityMeasurement.create(
+      img_load_ref, img_load_cap, ','.join(name + suffix for name in metrics))
+  metric_value = measurement.process(*process_args)
+  if len(metrics) == 1:
+    return metric_value
+  return json.dumps(ip.qualitymeasurement.get_json_value(
+      {name: metric_value[name + suffix] for name in metrics}), allow_nan=False)
+
+
+def get_tile_args(metric, tile_size, jobs):
+  if metric == 'ssim-tiled':
+    return (tile_size, jobs)
+  return ()
+
+
+def process_sequence_compare(img_load_ref, img_load_cap, metric, frames, jobs, *process_args):
+  sequence = ip.qualitymeasurement.QualityMeasurementSequence(
+      img_load_ref, img_load_cap, metric, frames)
+  summary = ip.qualitymeasurement.SequenceSummary()
+  for frame_idx, metric_value in sequence.process_frames(*process_args, jobs=jobs):
+    summary.append(frame_idx, metric_value)
+    print(frame_idx, metric_value, sep='\t', flush=True)
+  stats = summary.get()
+  return '\n'.join(key + '\t' + str(stats[key])
+                   for key in ['mean', 'min', 'worst_frame', 'infinite_frames'])
+
+
+def create_multichannel_loaders(multichannel_args, frame_idx=0):
   if len(multichannel_args) == 7:
     [metric,
      ref_img_dir, ref_pxl_fmt, ref_vd_sz,
@@ -34,19 +79,47 @@ def process_mulitchannel_compare(multichannel_args):
     [metric, ref_img_dir, cap_img_dir] = multichannel_args
     ref_pxl_fmt = ref_vd_sz = cap_pxl_fmt = cap_vd_sz = ''
   else:
-    return (False, 0.0)
+    return None
   video_size_ref = parse_video_size_arg(ref_vd_sz)
   video_size_cap = parse_video_size_arg(cap_vd_sz)
   img_load_ref = ip.imgloader.create(ref_img_dir, ref_pxl_fmt, video_size_ref)
   img_load_cap = ip.imgloader.create(cap_img_dir, cap_pxl_fmt, video_size_cap)
+  img_load_ref.seek(frame_idx)
+  img_load_cap.seek(frame_idx)
+  return metric, img_load_ref, img_load_cap
+
+
+def process_block_compare(multichannel_args, frame_idx, block_size, block_map_filename, worst):
+  loaders = create_multichannel_loaders(multichannel_args, frame_idx)
+  if loaders is None or loaders[0] not in ['psnr', 'mse', 'ssim']:
+    return (False, 0.0)
+  metric, img_load_ref, img_load_cap = loaders
+  blocks = ip.qualitymeasurement.QualityMeasurementBlocks(img_load_ref, img_load_cap, block_size)
+  block_map = blocks.process(metric)
+  blocks.write(block_map, block_map_filename)
+  worst_blocks = blocks.get_worst_blocks(block_map, worst, metric)
+  return (True, '\n'.join('\t'.join(str(val) for val in block) for block in worst_blocks))
+
+
+def process_mulitchannel_compare(multichannel_args, frame_idx=0, frames=None, jobs=1,
+                                 tile_size=512):
+  loaders = create_multichannel_loaders(multichannel_args, frame_idx)
+  if loaders is None:
+    return (False, 0.0)
+  metric, img_load_ref, img_load_cap = loaders
   if not is_metric_name_correct(metric):
     return (False, 0.0)
-  return(True,
-         ip.qualitymeasurement.QualityMeasurement.
-         create(img_load_ref, img_load_cap, metric).process())
+  if frames is not None:
+    if ',' in metric:
+      return (False, 0.0)
+    return (True, process_sequence_compare(
+        img_load_ref, img_load_cap, metric, frames, jobs, *get_tile_args(metric, tile_size, 1)))
+  return (True, process_compare(
+      img_load_ref, img_load_cap, metric, '', *get_tile_args(metric, tile_size, jobs)))
 
 
-def process_singlechannel_compare(singlechannel_args):
+def process_singlechannel_compare(singlechannel_args, frame_idx=0, frames=None, jobs=1,
+                                  tile_size=512):
   if len(singlechannel_args) == 8:
     [metric, channel_no,
      ref_img_dir, ref_pxl_fmt, ref_vd_sz,
@@ -60,11 +133,62 @@ def process_singlechannel_compare(singlechannel_args):
   video_size_cap = parse_video_size_arg(cap_vd_sz)
   img_load_ref = ip.imgloader.create(ref_img_dir, ref_pxl_fmt, video_size_ref)
   img_load_cap = ip.imgloader.create(cap_img_dir, cap_pxl_fmt, video_size_cap)
+  img_load_ref.seek(frame_idx)
+  img_load_cap.seek(frame_idx)
+  if not is_metric_name_correct(metric, True):
+    return (False, 0.0)
+  if frames is not None:
+    if ',' in metric:
+      return (False, 0.0)
+    return (True, process_sequence_compare(
+        img_load_ref, img_load_cap, metric + "-sc", frames, jobs, int(channel_no),
+        *get_tile_args(metric, tile_size, 1)))
+  return (True, process_compare(img_load_ref, img_load_cap, metric, "-sc", int(channel_no),
+                                *get_tile_args(metric, tile_size, jobs)))
+
+
+def process_reference_compare(reference_args, pixel_format='', video_size=None, frame_idx=0):
+  if len(reference_args) < 3:
+    return (False, 0.0)
+  metric, ref_img_dir = reference_args[:2]
   if not is_metric_name_correct(metric):
     return (False, 0.0)
-  return(True,
-         ip.qualitymeasurement.QualityMeasurement.
-         create(img_load_ref, img_load_cap, metric + "-sc").process(int(channel_no)))
+  img_load_ref = ip.imgloader.create(ref_img_dir, pixel_format, video_size)
+  img_load_ref.seek(frame_idx)
+  reference = ip.qualitymeasurement.ReferenceContext(img_load_ref)
+  for cap_img_dir in reference_args[2:]:
+    img_load_cap = ip.imgloader.create(cap_img_dir, pixel_format, video_size)
+    img_load_cap.seek(frame_idx)
+    metric_value = reference.process(img_load_cap, metric)
+    if ',' in metric:
+      metric_value = json.dumps(
+          ip.qualitymeasurement.get_json_value(metric_value), allow_nan=False)
+    print(cap_img_dir, metric_value, sep='\t', flush=True)
+  return (True, '')
+
+
+def print_peak_memory(enabled):
+  if enabled:
+    print('peak_memory', ip.qualitymeasurement.get_square_error_peak_bytes(), sep='\t',
+          file=sys.stderr)
+
+
+def process_gen_graph(gen_graph_filenames, out_filenames, jobs=1, background_filename=None,
+                      density_threshold=10000):
+  if not out_filenames:
+    if len(gen_graph_filenames) > 1:
+      raise ValueError('several graphs need one --gen_out file each')
+    ref_json, cap_json = gen_graph_filenames[0]
+    ip.graph.GraphHS.create(ref_json, cap_json, background_filename, density_threshold)
+    return
+  if len(out_filenames) != len(gen_graph_filenames):
+    raise ValueError(str(len(gen_graph_filenames)) + ' graphs but ' +
+                     str(len(out_filenames)) + ' --gen_out files')
+  graphs_filenames = [json_filenames + [out_filename] for json_filenames, out_filename
+                      in zip(gen_graph_filenames, out_filenames)]
+  for out_filename in ip.graph.export_graphs(graphs_filenames, jobs, background_filename,
+                                             density_threshold):
+    print(out_filename, flush=True)
 
 
 def main():
@@ -73,8 +197,9 @@ def main():
       '-i',
       '--imgfile',
       type=str,
-      help='Image file',
-      default=''
+      nargs='+',
+      help='Image file (with --rois: several files, directories or glob patterns)',
+      default=[]
   )
 
   parser.add_argument(
@@ -111,17 +236,104 @@ def main():
       '-flt',
       '--filter',
       type=str,
-      help='Output med, avg (Default: avg)',
+      help='Output med, avg, mode, pNN (percentile), trimNN (trimmed mean) (Default: avg)',
       default='avg'
   )
 
+  parser.add_argument(
+      '--rois',
+      type=str,
+      help='rois.json|rois.csv Read given rectangles of the images without gui',
+      default=''
+  )
+
+  parser.add_argument(
+      '--frame',
+      type=int,
+      help='Frame number of raw input (Default: 0)',
+      default=0
+  )
+
+  parser.add_argument(
+      '--frames',
+      type=str,
+      help='A:B range of raw input frames read with --rois or compared with -cp, -scp',
+      default=''
+  )
+
+  parser.add_argument(
+      '-j',
+      '--jobs',
+      type=int,
+      help='Number of worker processes (Default: 1)',
+      default=1
+  )
+
+  parser.add_argument(
+      '--tile',
+      type=int,
+      help='Tile size of ssim-tiled, tiles run in --jobs threads (Default: 512)',
+      default=512
+  )
+
+  parser.add_argument(
+      '--block_map',
+      type=str,
+      help='map.npy|map.png Write -cp psnr, mse or ssim of each block and print the worst blocks',
+      default=''
+  )
+
+  parser.add_argument(
+      '--block',
+      type=int,
+      help='Block size of --block_map (Default: 16)',
+      default=16
+  )
+
+  parser.add_argument(
+      '--peak_memory',
+      action='store_true',
+      help='Print peak bytes of the psnr/mse square error buffer to stderr after -cp/-scp/-cpref'
+  )
+
+  parser.add_argument(
+      '--worst',
+      type=int,
+      help='Number of worst blocks printed with --block_map (Default: 10)',
+      default=10
+  )
+
   parser.add_argument(
       '-gen',
       '--gen_graph',
       type=str,
-      help='gen_graph ref.json cap.json Generate graphs',
+      help='gen_graph ref.json cap.json Generate graphs (repeat with --gen_out for several)',
       nargs=2,
-      default=''
+      action='append',
+      default=None
+  )
+
+  parser.add_argument(
+      '--gen_out',
+      '--gen-out',
+      type=str,
+      help='Write -gen graph to png/svg/pdf file without display, one per -gen (-j workers)',
+      action='append',
+      default=None
+  )
+
+  parser.add_argument(
+      '--gen_cache',
+      type=str,
+      help='Hue/saturation background of -gen cached in given .npy file',
+      default=None
+  )
+
+  parser.add_argument(
+      '--gen_density',
+      type=int,
+      help='Sample count above which -gen draws histogram density, not points (Default: 10000)',
+      default=10000
   )
 
   parser.add_argument(
@@ -130,7 +342,7 @@ def main():
       type=str,
       nargs='+',
       #nargs=7,
-      help='compare two images using given metrics'
+      help='compare two images using given metrics (comma separated: psnr,ssim,mse)'
   )
 
   parser.add_argument(
@@ -141,50 +353,136 @@ def main():
       help='compare two images using given metrics for given channel'
   )
 
+  parser.add_argument(
+      '-cpref',
+      '--compare_reference',
+      type=str,
+      nargs='+',
+      help='metrics ref capture [capture ...] compare many captures with one reference'
+  )
+
+  parser.add_argument(
+      '--serve',
+      type=str,
+      nargs='?',
+      const='',
+      help='[socket] Run compare and sample json line jobs from stdin or unix socket',
+      default=None
+  )
+
   args = parser.parse_args()
   pixel_format = args.pixel_format.lower()
   output_format = args.output_format.lower()
   video_size = parse_video_size_arg(args.video_size)
   filter_type = args.filter.lower()
 
-  img_file = args.imgfile
+  img_files = args.imgfile
   out_json_file = args.out
+  rois_filename = args.rois
   gen_graph_filenames = args.gen_graph
   compare_multichannel = args.compare
   compare_singlechannel = args.compare_singlechannel
 
+  if args.serve is not None:
+    try:
+      if args.serve == '':
+        ip.server.serve_stdin(sys.stdin, sys.stdout, args.jobs)
+      else:
+        ip.server.serve_unix(args.serve, args.jobs)
+    except OSError as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot serve: ' + str(err))
+    sys.exit(0)
+
   #colorscope -compare metrics [channelId] refImageDir [ref_pixel_format] \
   #[ref_video_size] capImageDir [cap_pixel_format] [cap_video_size]
+  if compare_multichannel and args.block_map != '':
+    try:
+      result, worst_blocks = process_block_compare(
+          compare_multichannel, args.frame, args.block, args.block_map, args.worst)
+    except (AttributeError, ValueError, IndexError) as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot write block map: ' + str(err))
+    if result is True:
+      print(worst_blocks)
+      sys.exit(0)
+    sys.exit('Compare finished unsucessfuly for given metric.')
+
   if compare_multichannel:
-    result, metric_value = process_mulitchannel_compare(compare_multichannel)
+    try:
+      result, metric_value = process_mulitchannel_compare(
+          compare_multichannel, args.frame, parse_frames_arg(args.frames), args.jobs,
+          args.tile)
+    except (ValueError, IndexError) as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot compare: ' + str(err))
     if result is True:
       print(metric_value)
+      print_peak_memory(args.peak_memory)
       sys.exit(0)
     sys.exit('Compare finished unsucessfuly for given metric.')
 
   if compare_singlechannel:
-    result, metric_value = process_singlechannel_compare(compare_singlechannel)
+    try:
+      result, metric_value = process_singlechannel_compare(
+          compare_singlechannel, args.frame, parse_frames_arg(args.frames), args.jobs,
+          args.tile)
+    except (ValueError, IndexError) as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot compare: ' + str(err))
     if result is True:
       print(metric_value)
+      print_peak_memory(args.peak_memory)
       sys.exit(0)
     sys.exit('Compare finished unsucessfuly for given metric.')
 
-  if gen_graph_filenames != '':
-    ref_json, cap_json = gen_graph_filenames
+  if args.compare_reference:
     try:
-      ip.graph.GraphHS.create(ref_json, cap_json)
-    except (AttributeError, ValueError) as err:
+      result, _ = process_reference_compare(
+          args.compare_reference, pixel_format, video_size, args.frame)
+    except IndexError as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot compare: ' + str(err))
+    if result is True:
+      print_peak_memory(args.peak_memory)
+      sys.exit(0)
+    sys.exit('Compare finished unsucessfuly for given metric.')
+
+  if gen_graph_filenames:
+    try:
+      process_gen_graph(gen_graph_filenames, args.gen_out, args.jobs, args.gen_cache,
+                        args.gen_density)
+    except (AttributeError, ValueError, OSError) as err:
       err = sys.exc_info()[1]
       sys.exit('Cannot generate graph: ' + str(err))
     sys.exit(0)
 
-  if not os.path.exists(img_file):
+  if rois_filename != '':
+    frames = parse_frames_arg(args.frames) or slice(args.frame, args.frame + 1)
+    try:
+      batch_reader = ip.batchreader.create(
+          output_format,
+          filter_type,
+          rois_filename,
+          pixel_format,
+          video_size,
+          frames
+      )
+      batch_reader.read(ip.batchreader.expand_images(img_files), out_json_file, args.jobs)
+    except (AttributeError, ValueError, OSError, IndexError) as err:
+      err = sys.exc_info()[1]
+      sys.exit('Cannot read rois: ' + str(err))
+    sys.exit(0)
+
+  if len(img_files) != 1 or not os.path.exists(img_files[0]):
     sys.exit('File not found')
+  img_file = img_files[0]
 
 
   img_loader = ip.imgloader.create(img_file, pixel_format, video_size)
 
   try:
+    img_loader.seek(args.frame)
     color_reader = ip.colorreader.create(
         output_format,
         img_loader,
@@ -192,7 +490,7 @@ def main():
         out_json_file
     )
     color_reader.processing()
-  except (AttributeError, ValueError) as err:
+  except (AttributeError, ValueError, IndexError) as err:
     err = sys.exc_info()[1]
     sys.exit('Cannot read image: ' + str(err))
 
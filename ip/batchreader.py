@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Read color values of roi list without gui"""
+
+import os
+import csv
+import glob
+import json
+import concurrent.futures
+import ip.colorjson
+import ip.colorreader
+import ip.imgloader
+
+
+def parse_rect(values):
+  if len(values) == 2:
+    values = list(values[0]) + list(values[1])
+  if len(values) != 4:
+    raise ValueError('Roi: ' + str(values) + ' is not x1, y1, x2, y2')
+  p1_x, p1_y, p2_x, p2_y = [int(val) for val in values]
+  return [[p1_x, p1_y], [p2_x, p2_y]]
+
+
+def load_rois(rois_filename):
+  if not os.path.exists(rois_filename):
+    raise FileNotFoundError('Roi file :' + rois_filename + ' not found')
+
+  with open(rois_filename) as rois_file:
+    if os.path.splitext(rois_filename)[1].lower() == '.csv':
+      rows = [row for row in csv.reader(rois_file) if row]
+      if rows and not rows[0][0].strip().lstrip('-').isdigit():
+        rows = rows[1:]
+    else:
+      rows = json.load(rois_file)
+
+  rois = [parse_rect(row) for row in rows]
+  if not rois:
+    raise ValueError('Roi file :' + rois_filename + ' is empty')
+  return rois
+
+
+def is_image_file(filename):
+  image_exts = ['.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.yuv', '.raw']
+  return os.path.splitext(filename)[1].lower() in image_exts
+
+
+def expand_images(img_patterns):
+  img_filenames = []
+  for img_pattern in img_patterns:
+    if os.path.isdir(img_pattern):
+      img_filenames.extend(sorted(
+          os.path.join(img_pattern, filename) for filename in os.listdir(img_pattern)
+          if is_image_file(filename)))
+    elif any(char in img_pattern for char in '*?['):
+      img_filenames.extend(sorted(glob.glob(img_pattern)))
+    else:
+      img_filenames.append(img_pattern)
+  return img_filenames
+
+
+class BatchReader:
+  # pylint: disable=too-many-arguments
+  def __init__(self, color_format, filter_type, rois, pixel_format='', video_size=None,
+               frames=slice(0, 1)):
+    self.__color_format = color_format
+    self.__filter_type = filter_type
+    self.__rois = rois
+    self.__pixel_format = pixel_format
+    self.__video_size = video_size
+    self.__frames = frames
+
+  def read_colors(self, img_filenames):
+    colors = []
+    color_reader = None
+    for img_filename in img_filenames:
+      if not os.path.exists(img_filename):
+        raise FileNotFoundError('Image file :' + img_filename + ' not found')
+      img_loader = ip.imgloader.create(img_filename, self.__pixel_format, self.__video_size)
+      frame_ids = range(len(img_loader))[self.__frames]
+      if not frame_ids:
+        raise IndexError('BatchReader: no frames of ' + img_filename + ' in range ' +
+                         str(self.__frames.start) + ':' + str(self.__frames.stop))
+      for frame_idx in frame_ids:
+        img_loader.seek(frame_idx)
+        if color_reader is None:
+          color_reader = ip.colorreader.create(
+              self.__color_format,
+              img_loader,
+              self.__filter_type,
+              ''
+          )
+        else:
+          color_reader.set_image(img_loader.imread())
+        colors.extend(color_reader.read_rect_color(rect) for rect in self.__rois)
+    return colors
+
+  def read(self, img_filenames, out_json_filename, jobs=1):
+    if not img_filenames:
+      raise ValueError('BatchReader: no input images')
+    color_json = ip.colorjson.create_serializer(self.__color_format, out_json_filename)
+
+    if jobs > 1 and len(img_filenames) > 1:
+      chunk_len = -(-len(img_filenames) // (jobs * 4))
+      chunks = [img_filenames[i:i + chunk_len]
+                for i in range(0, len(img_filenames), chunk_len)]
+      with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        chunk_colors = list(executor.map(self.read_colors, chunks))
+    else:
+      chunk_colors = [self.read_colors(img_filenames)]
+
+    for colors in chunk_colors:
+      for color in colors:
+        color_json.append(color)
+    color_json.write()
+
+
+# pylint: disable=too-many-arguments
+def create(color_format, filter_type, rois_filename, pixel_format='', video_size=None,
+           frames=slice(0, 1)):
+  return BatchReader(
+      color_format,
+      filter_type,
+      load_rois(rois_filename),
+      pixel_format,
+      video_size,
+      frames
+  )
@@ -2,7 +2,81 @@
 """Color data filter"""
 
 import abc
+import re
 import numpy as np
+import cv2
+
+
+HISTOGRAM_BLOCK_PIXELS = 1 << 24
+
+
+class ChannelHistogram:
+  def __init__(self, img):
+    if img.ndim == 2:
+      img = img[:, :, np.newaxis]
+    if img.size == 0:
+      raise ValueError('ChannelHistogram: empty roi')
+    height, width, num_channels = img.shape
+    block_rows = max(1, HISTOGRAM_BLOCK_PIXELS // width)
+    self.__hist = np.zeros((num_channels, 256), np.int64)
+    for row in range(0, height, block_rows):
+      block = img[row:row + block_rows]
+      for channel in range(num_channels):
+        self.__hist[channel] += np.int64(
+            cv2.calcHist([block], [channel], None, [256], [0, 256]).ravel())
+    self.__cumsum = np.cumsum(self.__hist, axis=1)
+    self.__count = height * width
+
+  def __value_at(self, rank):
+    return np.argmax(self.__cumsum > rank, axis=1)
+
+  def percentile(self, perc):
+    rank = perc / 100.0 * (self.__count - 1)
+    rank_low = int(np.floor(rank))
+    rank_high = min(rank_low + 1, self.__count - 1)
+    val_low = self.__value_at(rank_low)
+    val_high = self.__value_at(rank_high)
+    return val_low + (val_high - val_low) * (rank - rank_low)
+
+  def median(self):
+    return self.percentile(50)
+
+  def mode(self):
+    return np.argmax(self.__hist, axis=1)
+
+  def trimmed_mean(self, perc):
+    cut = int(self.__count * perc / 100.0)
+    if 2 * cut >= self.__count:
+      return self.median()
+    lower = np.clip(self.__cumsum - self.__hist, cut, self.__count - cut)
+    upper = np.clip(self.__cumsum, cut, self.__count - cut)
+    weights = upper - lower
+    return np.dot(weights, np.arange(256)) / float(self.__count - 2 * cut)
+
+
+class IntegralImage:
+  def __init__(self, img):
+    h, w = img.shape[:2]
+    sdepth = cv2.CV_32S if h * w * 255 < 2**31 else cv2.CV_64F
+    self.__table = cv2.integral(img, sdepth=sdepth).reshape(h + 1, w + 1, -1)
+    self.__shape = (h, w)
+
+  def sum(self, min_x, min_y, max_x, max_y):
+    h, w = self.__shape
+    y0, y1, _ = slice(min_y, max_y).indices(h)
+    x0, x1, _ = slice(min_x, max_x).indices(w)
+    if y1 <= y0 or x1 <= x0:
+      return None, 0
+    table = self.__table
+    area = (y1 - y0) * (x1 - x0)
+    channel_sum = table[y1, x1].astype(np.int64) - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    return channel_sum, area
+
+  def average(self, min_x, min_y, max_x, max_y):
+    channel_sum, area = self.sum(min_x, min_y, max_x, max_y)
+    if area == 0:
+      raise ValueError('IntegralImage: empty roi')
+    return [int(val) for val in channel_sum / float(area)]
 
 
 class ColorChannelFilter(metaclass=abc.ABCMeta):
@@ -12,45 +86,103 @@ class ColorChannelFilter(metaclass=abc.ABCMeta):
 
   @staticmethod
   def _get_channel_data(img):
-    h, w, num_channels = img.shape
-    channel_data = [[] for i in range(num_channels)]
-    for y in range(0, h):
-      for x in range(0, w):
-        channels = img[y, x, :]
-        for i in range(0, num_channels):
-          channel_data[i].append(int(channels[i]))
-    return channel_data
+    num_channels = img.shape[-1] if img.ndim == 3 else 1
+    return img.reshape(-1, num_channels)
 
   @staticmethod
   def create(filter_type):
     if filter_type == 'med':
       return ColorChannelFilterMedian()
+    if filter_type == 'mode':
+      return ColorChannelFilterMode()
+    percentile = re.fullmatch(r'p(\d+(?:\.\d+)?)', filter_type)
+    if percentile:
+      return ColorChannelFilterPercentile(float(percentile.group(1)))
+    trimmed = re.fullmatch(r'trim(\d+(?:\.\d+)?)?', filter_type)
+    if trimmed:
+      return ColorChannelFilterTrimmedMean(float(trimmed.group(1) or 10))
     return ColorChannelFilterAverage()
 
 
-class ColorChannelFilterMedian(ColorChannelFilter):
+class ColorChannelFilterHistogram(ColorChannelFilter):
+  @abc.abstractmethod
+  def _get_statistic(self, histogram):
+    pass
+
+  def filter_histogram(self, histogram):
+    return [int(val) for val in self._get_statistic(histogram)]
+
+  def filter(self, img):
+    if img.dtype != np.uint8:
+      raise ValueError('ColorChannelFilterHistogram: uint8 image expected')
+    return self.filter_histogram(get_histogram(img))
+
+
+class ColorChannelFilterMedian(ColorChannelFilterHistogram):
   def __median(self, img):
-    channel_filtered = []
     channel_data = self._get_channel_data(img)
-    for channel_val in channel_data:
-      channel_filtered.append(int(np.median(channel_val)))
-    return channel_filtered
+    return [int(val) for val in np.median(channel_data, axis=0)]
+
+  def _get_statistic(self, histogram):
+    return histogram.median()
 
   def filter(self, img):
-    return self.__median(img)
+    if img.dtype != np.uint8:
+      return self.__median(img)
+    return super().filter(img)
+
+
+class ColorChannelFilterPercentile(ColorChannelFilterHistogram):
+  def __init__(self, perc):
+    if not 0 <= perc <= 100:
+      raise AttributeError('ColorChannelFilterPercentile: ' + str(perc) + ' out of range')
+    self.__perc = perc
+
+  def _get_statistic(self, histogram):
+    return histogram.percentile(self.__perc)
+
+
+class ColorChannelFilterTrimmedMean(ColorChannelFilterHistogram):
+  def __init__(self, perc=10):
+    if not 0 <= perc < 50:
+      raise AttributeError('ColorChannelFilterTrimmedMean: ' + str(perc) + ' out of range')
+    self.__perc = perc
+
+  def _get_statistic(self, histogram):
+    return histogram.trimmed_mean(self.__perc)
+
+
+class ColorChannelFilterMode(ColorChannelFilterHistogram):
+  def _get_statistic(self, histogram):
+    return histogram.mode()
 
 
 class ColorChannelFilterAverage(ColorChannelFilter):
   def __average(self, img):
-    channel_filtered = []
     channel_data = self._get_channel_data(img)
-    for channel_val in channel_data:
-      channel_filtered.append(int(np.average(channel_val)))
-    return channel_filtered
+    return [int(val) for val in np.average(channel_data, axis=0)]
 
   def filter(self, img):
     return self.__average(img)
 
 
+def get_histogram(img):
+  return ChannelHistogram(img)
+
+
+def filter_all(img, filter_types):
+  histogram = None
+  filtered = {}
+  for filter_type in filter_types:
+    color_filter = create(filter_type)
+    if isinstance(color_filter, ColorChannelFilterHistogram) and img.dtype == np.uint8:
+      if histogram is None:
+        histogram = get_histogram(img)
+      filtered[filter_type] = color_filter.filter_histogram(histogram)
+    else:
+      filtered[filter_type] = color_filter.filter(img)
+  return filtered
+
+
 def create(filter_type):
   return ColorChannelFilter.create(filter_type)
@@ -4,23 +4,149 @@
 import os
 import json
 import abc
+import time
+import threading
+import numpy as np
+
+BINARY_EXTENSION = '.cbin'
+BINARY_ALIGNMENT = 64
+NDJSON_EXTENSION = '.ndjson'
+
+
+def is_binary_filename(filename):
+  return os.path.splitext(filename)[1].lower() == BINARY_EXTENSION
+
+
+def is_ndjson_filename(filename):
+  return os.path.splitext(filename)[1].lower() == NDJSON_EXTENSION
+
+
+def get_binary_dtype(values):
+  if values.size == 0 or np.issubdtype(values.dtype, np.integer):
+    if values.size == 0 or (values.min() >= 0 and values.max() <= 255):
+      return np.uint8
+    return np.int32
+  return np.float32
+
+
+def get_channel_names(color_data):
+  return list(color_data['format'])
+
+
+def write_binary(filename, color_data):
+  channel_names = get_channel_names(color_data)
+  values = np.array([color_data['channels'][name] for name in channel_names])
+  values = values.reshape(len(channel_names), -1)
+  dtype = get_binary_dtype(values)
+  header = json.dumps({
+      'format': color_data['format'],
+      'channels': channel_names,
+      'count': values.shape[1],
+      'dtype': np.dtype(dtype).name
+  })
+  header_len = -(-(len(header) + 1) // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+  with open(filename, 'wb') as outfile:
+    outfile.write((header.ljust(header_len - 1) + '\n').encode())
+    outfile.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+
+def read_binary(filename):
+  with open(filename, 'rb') as color_file:
+    header_line = color_file.readline()
+  header = json.loads(header_line.decode())
+  shape = (len(header['channels']), header['count'])
+  if header['count'] == 0:
+    values = np.empty(shape, header['dtype'])
+  else:
+    values = np.memmap(filename, header['dtype'], 'r', len(header_line), shape)
+  return {
+      'format': header['format'],
+      'channels': {name: values[i] for i, name in enumerate(header['channels'])}
+  }
 
 
 class JsonSerializer(metaclass=abc.ABCMeta):
-  def __init__(self, filename):
+  # pylint: disable=too-many-instance-attributes
+  def __init__(self, filename, flush_every=1000, flush_interval=1.0):
     self.__filename = filename
     self._color_data = {}
+    self.__stream = None
+    self.__stream_mode = 'w'
+    self.__flush_every = flush_every
+    self.__flush_interval = flush_interval
+    self.__unflushed = 0
+    self.__flush_time = time.monotonic()
+    self.__flush_timer = None
+    self.__lock = threading.RLock()
+
+  def __open_stream(self):
+    self.__stream = open(self.__filename, self.__stream_mode)  # pylint: disable=consider-using-with
+    if self.__stream_mode == 'w':
+      header = {
+          'format': self._color_data['format'],
+          'channels': get_channel_names(self._color_data)
+      }
+      self.__stream.write(json.dumps(header) + '\n')
+      self.__stream_mode = 'a'
+    self.flush()
+
+  def __append_record(self, color):
+    with self.__lock:
+      if self.__stream is None:
+        self.__open_stream()
+      self.__stream.write(json.dumps(np.asarray(color).tolist()) + '\n')
+      self.__unflushed += 1
+      elapsed = time.monotonic() - self.__flush_time
+      if self.__unflushed >= self.__flush_every or elapsed >= self.__flush_interval:
+        self.flush()
+      elif self.__flush_timer is None:
+        self.__flush_timer = threading.Timer(self.__flush_interval - elapsed, self.__flush_pending)
+        self.__flush_timer.daemon = True
+        self.__flush_timer.start()
+
+  def __flush_pending(self):
+    with self.__lock:
+      self.__flush_timer = None
+      if self.__unflushed:
+        self.flush()
+
+  def __cancel_flush_timer(self):
+    if self.__flush_timer is not None:
+      self.__flush_timer.cancel()
+      self.__flush_timer = None
+
+  def flush(self):
+    with self.__lock:
+      if self.__stream is not None:
+        self.__stream.flush()
+      self.__unflushed = 0
+      self.__flush_time = time.monotonic()
 
   def append(self, color):
     length = len(color)
     if length != len(self._color_data['format']):
       raise ValueError('Number of channels not match')
 
+    if is_ndjson_filename(self.__filename):
+      self.__append_record(color)
+      return
+
     for i in range(0, length):
       channel = self._color_data['format'][i]
       self._color_data['channels'][channel].append(color[i])
 
   def write(self):
+    if is_ndjson_filename(self.__filename):
+      with self.__lock:
+        self.__cancel_flush_timer()
+        if self.__stream is None:
+          self.__open_stream()
+        self.__stream.close()
+        self.__stream = None
+      return
+    if is_binary_filename(self.__filename):
+      write_binary(self.__filename, self._color_data)
+      return
     with open(self.__filename, 'w') as outfile:
       json.dump(self._color_data, outfile)
 
@@ -57,13 +183,93 @@ class JsonSerializerHLS(JsonSerializer):
     }
 
 
+def create_serializer(color_format, filename):
+  serializers = {
+      'rgb': JsonSerializerRGB,
+      'yuv': JsonSerializerYUV,
+      'hsv': JsonSerializerHSV,
+      'hls': JsonSerializerHLS
+  }
+  if color_format not in serializers:
+    raise AttributeError('create_serializer: ' + color_format + ' not found')
+  return serializers[color_format](filename)
+
+
+def read_ndjson_header(filename):
+  with open(filename) as color_file:
+    return json.loads(color_file.readline())
+
+
+def read_ndjson_records(filename):
+  with open(filename) as color_file:
+    color_file.readline()
+    for line in color_file:
+      if line.strip():
+        yield json.loads(line)
+
+
 class JsonDeserializer:
   def __init__(self, json_filename):
     if not os.path.exists(json_filename):
       raise FileNotFoundError('Json file :' + json_filename + ' not found')
 
-    with open(json_filename) as color_file:
-      self.__color_data = json.load(color_file)
+    self.__filename = json_filename
+    self.__color_data = None
+    if is_ndjson_filename(json_filename):
+      self.__header = read_ndjson_header(json_filename)
+      return
+
+    if is_binary_filename(json_filename):
+      self.__color_data = read_binary(json_filename)
+    else:
+      with open(json_filename) as color_file:
+        self.__color_data = json.load(color_file)
+    self.__header = {
+        'format': self.__color_data['format'],
+        'channels': get_channel_names(self.__color_data)
+    }
+
+  def get_format(self):
+    return self.__header['format']
+
+  def iter_records(self):
+    if self.__color_data is None:
+      yield from read_ndjson_records(self.__filename)
+      return
+    yield from zip(*[self.__color_data['channels'][name] for name in self.__header['channels']])
+
+  def iter_chunks(self, chunk_size=65536):
+    channel_names = self.__header['channels']
+    if self.__color_data is not None:
+      channels = [np.asarray(self.__color_data['channels'][name]) for name in channel_names]
+      for start in range(0, min(len(values) for values in channels), chunk_size):
+        yield {
+            'format': self.__header['format'],
+            'channels': {name: values[start:start + chunk_size]
+                         for name, values in zip(channel_names, channels)}
+        }
+      return
+    records = []
+    for record in self.iter_records():
+      records.append(record)
+      if len(records) == chunk_size:
+        yield self.__get_chunk(channel_names, records)
+        records = []
+    if records:
+      yield self.__get_chunk(channel_names, records)
+
+  def __get_chunk(self, channel_names, records):
+    values = np.array(records).reshape(len(records), len(channel_names))
+    return {
+        'format': self.__header['format'],
+        'channels': {name: values[:, i] for i, name in enumerate(channel_names)}
+    }
 
   def get(self):
+    if self.__color_data is None:
+      channels = {name: [] for name in self.__header['channels']}
+      for record in self.iter_records():
+        for name, value in zip(self.__header['channels'], record):
+          channels[name].append(value)
+      return {'format': self.__header['format'], 'channels': channels}
     return self.__color_data
@@ -2,6 +2,211 @@
 """Calculate color paramters"""
 
 import numpy as np
+import cv2
+
+TO_BGR_CODES = {
+    'rgb': cv2.COLOR_RGB2BGR,
+    'yuv': cv2.COLOR_YUV2BGR,
+    'hsv': cv2.COLOR_HSV2BGR,
+    'hls': cv2.COLOR_HLS2BGR
+}
+
+
+XYZ_FROM_RGB = np.array([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227]
+])
+WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+SRGB_LINEAR = np.array([
+    ((val + 0.055) / 1.055) ** 2.4 if val > 0.04045 else val / 12.92
+    for val in np.arange(256) / 255.0
+])
+
+
+def as_float(values):
+  values = np.asarray(values)
+  return values if np.issubdtype(values.dtype, np.floating) else values.astype(np.float64)
+
+
+def bgr_to_lab(img_bgr, dtype=np.float64):
+  linear_rgb = SRGB_LINEAR.astype(dtype)[np.asarray(img_bgr, dtype=np.uint8)[..., ::-1]]
+  xyz = np.matmul(linear_rgb, (XYZ_FROM_RGB / WHITE_D65[:, np.newaxis]).T.astype(dtype))
+  epsilon = (6.0 / 29) ** 3
+  xyz = np.where(xyz > epsilon, np.cbrt(xyz), xyz / (3 * (6.0 / 29) ** 2) + 4.0 / 29)
+  f_x, f_y, f_z = np.moveaxis(xyz, -1, 0)
+  return np.stack([116 * f_y - 16, 500 * (f_x - f_y), 200 * (f_y - f_z)], axis=-1)
+
+
+def to_lab(values, color_format):
+  if color_format not in TO_BGR_CODES:
+    raise AttributeError('to_lab: ' + str(color_format) + ' not found')
+  values = np.asarray(values, dtype=float).reshape(-1, 1, 3)
+  img = np.uint8(np.clip(np.round(values), 0, 255))
+  img_bgr = cv2.cvtColor(img, TO_BGR_CODES[color_format])
+  return bgr_to_lab(img_bgr).reshape(-1, 3)
+
+
+def delta_e76(lab_ref, lab_cap):
+  return np.sqrt(np.sum(np.square(np.subtract(lab_cap, lab_ref)), axis=-1))
+
+
+def delta_e94(lab_ref, lab_cap, k_1=0.045, k_2=0.015):
+  l_1, a_1, b_1 = np.moveaxis(as_float(lab_ref), -1, 0)
+  l_2, a_2, b_2 = np.moveaxis(as_float(lab_cap), -1, 0)
+  c_1 = np.hypot(a_1, b_1)
+  c_2 = np.hypot(a_2, b_2)
+  delta_c = c_1 - c_2
+  delta_h_square = np.maximum(np.square(a_1 - a_2) + np.square(b_1 - b_2) - np.square(delta_c), 0)
+  return np.sqrt(np.square(l_1 - l_2) + np.square(delta_c / (1 + k_1 * c_1)) +
+                 delta_h_square / np.square(1 + k_2 * c_1))
+
+
+def delta_e2000(lab_ref, lab_cap):
+  # pylint: disable=too-many-locals
+  l_1, a_1, b_1 = np.moveaxis(as_float(lab_ref), -1, 0)
+  l_2, a_2, b_2 = np.moveaxis(as_float(lab_cap), -1, 0)
+  c_mean7 = np.power((np.hypot(a_1, b_1) + np.hypot(a_2, b_2)) / 2, 7)
+  g_factor = 0.5 * (1 - np.sqrt(c_mean7 / (c_mean7 + 25.0 ** 7)))
+  a_1, a_2 = a_1 * (1 + g_factor), a_2 * (1 + g_factor)
+  c_1, c_2 = np.hypot(a_1, b_1), np.hypot(a_2, b_2)
+  h_1 = np.degrees(np.arctan2(b_1, a_1)) % 360
+  h_2 = np.degrees(np.arctan2(b_2, a_2)) % 360
+
+  chroma_zero = (c_1 * c_2) == 0
+  delta_h = h_2 - h_1
+  delta_h = np.where(delta_h > 180, delta_h - 360, np.where(delta_h < -180, delta_h + 360, delta_h))
+  delta_h = np.where(chroma_zero, 0, delta_h)
+  delta_big_h = 2 * np.sqrt(c_1 * c_2) * np.sin(np.radians(delta_h) / 2)
+
+  l_mean = (l_1 + l_2) / 2
+  c_mean = (c_1 + c_2) / 2
+  h_mean = (h_1 + h_2) / 2
+  h_mean = np.where(np.abs(h_1 - h_2) > 180,
+                    np.where(h_mean < 180, h_mean + 180, h_mean - 180), h_mean)
+  h_mean = np.where(chroma_zero, h_1 + h_2, h_mean)
+
+  t_factor = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) +
+              0.24 * np.cos(np.radians(2 * h_mean)) +
+              0.32 * np.cos(np.radians(3 * h_mean + 6)) -
+              0.20 * np.cos(np.radians(4 * h_mean - 63)))
+  l_mean50 = np.square(l_mean - 50)
+  s_l = 1 + 0.015 * l_mean50 / np.sqrt(20 + l_mean50)
+  s_c = 1 + 0.045 * c_mean
+  s_h = 1 + 0.015 * c_mean * t_factor
+  c_mean7 = np.power(c_mean, 7)
+  r_t = (-2 * np.sqrt(c_mean7 / (c_mean7 + 25.0 ** 7)) *
+         np.sin(np.radians(60 * np.exp(-np.square((h_mean - 275) / 25)))))
+
+  term_l = (l_2 - l_1) / s_l
+  term_c = (c_2 - c_1) / s_c
+  term_h = delta_big_h / s_h
+  return np.sqrt(np.square(term_l) + np.square(term_c) + np.square(term_h) + r_t * term_c * term_h)
+
+
+def get_delta_e(lab_ref, lab_cap, method='2000'):
+  methods = {'76': delta_e76, '94': delta_e94, '2000': delta_e2000}
+  if method not in methods:
+    raise AttributeError('get_delta_e: method ' + str(method) + ' not found')
+  return methods[method](lab_ref, lab_cap)
+
+
+def get_delta_e_map(img_ref, img_cap, method='2000', band_rows=256):
+  if img_ref.shape != img_cap.shape:
+    raise AttributeError('Unmatching images size')
+  delta_e_map = np.empty(img_ref.shape[:2], np.float32)
+  for row in range(0, img_ref.shape[0], band_rows):
+    rows = slice(row, row + band_rows)
+    delta_e_map[rows] = get_delta_e(
+        bgr_to_lab(img_ref[rows], np.float32), bgr_to_lab(img_cap[rows], np.float32), method)
+  return delta_e_map
+
+
+class HLSDeltaAccumulator:
+  def __init__(self):
+    self.__count = 0
+    self.__delta_perc_sum = np.zeros(3)
+    self.__hue_sin_sum = 0.0
+    self.__hue_cos_sum = 0.0
+    self.__delta_sum = np.zeros(2)
+    self.__delta_square_sum = np.zeros(2)
+    self.__delta_max = np.zeros(3)
+
+  @staticmethod
+  def get_delta_perc(ref, cap):
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return np.where(ref == 0, 0, (cap * 100.0) / ref)
+
+  @staticmethod
+  def get_hue_delta_deg(ref_h, cap_h):
+    return (2.0 * (cap_h - ref_h) + 180.0) % 360.0 - 180.0
+
+  @staticmethod
+  def __is_8bit(values):
+    return np.issubdtype(values.dtype, np.integer) and \
+        (values.size == 0 or (values.min() >= 0 and values.max() <= 255))
+
+  def __append_weighted(self, ref, cap, weights):
+    self.__count += int(weights[:, 0].sum())
+    self.__delta_perc_sum += (weights * self.get_delta_perc(ref, cap)).sum(axis=0)
+
+    hue_delta = np.radians(self.get_hue_delta_deg(ref[:, 0], cap[:, 0]))
+    self.__hue_sin_sum += np.dot(weights[:, 0], np.sin(hue_delta))
+    self.__hue_cos_sum += np.dot(weights[:, 0], np.cos(hue_delta))
+
+    delta = cap[:, 1:] - ref[:, 1:]
+    self.__delta_sum += (weights[:, 1:] * delta).sum(axis=0)
+    self.__delta_square_sum += (weights[:, 1:] * np.square(delta)).sum(axis=0)
+    abs_delta = np.column_stack([np.degrees(np.abs(hue_delta)), np.abs(delta)])
+    abs_delta[weights == 0] = 0
+    self.__delta_max = np.maximum(self.__delta_max, abs_delta.max(axis=0))
+
+  def append(self, ref, cap):
+    ref = np.asarray(ref).reshape(-1, 3)
+    cap = np.asarray(cap).reshape(-1, 3)
+    if len(ref) == 0:
+      return
+    if self.__is_8bit(ref) and self.__is_8bit(cap):
+      pairs = ref.astype(np.intp) * 256 + cap
+      weights = np.column_stack(
+          [np.bincount(pairs[:, i], minlength=256 * 256) for i in range(3)]).astype(float)
+      ref_values, cap_values = np.divmod(np.arange(256 * 256, dtype=float), 256)
+      self.__append_weighted(np.column_stack([ref_values] * 3),
+                             np.column_stack([cap_values] * 3), weights)
+      return
+    self.__append_weighted(ref.astype(float), cap.astype(float), np.ones(ref.shape))
+
+  def get_count(self):
+    return self.__count
+
+  def get_delta_perc_average(self):
+    if self.__count == 0:
+      raise ValueError('HLSDeltaAccumulator: no samples')
+    return list(self.__delta_perc_sum / self.__count)
+
+  def get_stats(self):
+    if self.__count == 0:
+      raise ValueError('HLSDeltaAccumulator: no samples')
+    hue_sin = self.__hue_sin_sum / self.__count
+    hue_cos = self.__hue_cos_sum / self.__count
+    resultant = min(1.0, np.hypot(hue_sin, hue_cos))
+    mean = self.__delta_sum / self.__count
+    std = np.sqrt(np.maximum(self.__delta_square_sum / self.__count - np.square(mean), 0))
+    stats = {
+        'count': self.__count,
+        'h': {
+            'mean': float(np.degrees(np.arctan2(hue_sin, hue_cos))),
+            'std': float(np.degrees(np.sqrt(-2 * np.log(resultant)))) if resultant > 0 else np.inf,
+            'max': float(self.__delta_max[0])
+        }
+    }
+    for i, channel in enumerate('ls'):
+      stats[channel] = {
+          'mean': float(mean[i]),
+          'std': float(std[i]),
+          'max': float(self.__delta_max[i + 1])
+      }
+    return stats
 
 
 class ColorMeter:
@@ -9,26 +214,38 @@ class ColorMeter:
     self.__ref_color = ref_color
     self.__cap_color = cap_color
 
-  def get_hls_delta_perc(self):
-    if (self.__ref_color.get()['format'] != 'hls' or
-        self.__cap_color.get()['format'] != 'hls'):
+  def __accumulate_hls(self):
+    if (self.__ref_color.get_format() != 'hls' or
+        self.__cap_color.get_format() != 'hls'):
       raise AttributeError('Color not HLS type')
 
-    cap_channels = self.__cap_color.get()['channels']
-    ref_channels = self.__ref_color.get()['channels']
+    accumulator = HLSDeltaAccumulator()
+    for ref_chunk, cap_chunk in zip(self.__ref_color.iter_chunks(),
+                                    self.__cap_color.iter_chunks()):
+      length = min(len(ref_chunk['channels']['h']), len(cap_chunk['channels']['h']))
+      accumulator.append(
+          np.column_stack([ref_chunk['channels'][channel][:length] for channel in 'hls']),
+          np.column_stack([cap_chunk['channels'][channel][:length] for channel in 'hls']))
+    return accumulator
 
-    ref_h, cap_h = ref_channels['h'], cap_channels['h']
-    ref_l, cap_l = ref_channels['l'], cap_channels['l']
-    ref_s, cap_s = ref_channels['s'], cap_channels['s']
-
-    delta_perc = lambda ref, cap: 0 if ref == 0 else (cap * 100.0) / ref
+  def get_hls_delta_perc(self):
+    accumulator = self.__accumulate_hls()
+    if accumulator.get_count() == 0:
+      return [np.nan] * 3
+    return accumulator.get_delta_perc_average()
 
-    delta_h_perc_data = [delta_perc(ref, cap) for ref, cap in zip(ref_h, cap_h)]
-    delta_l_perc_data = [delta_perc(ref, cap) for ref, cap in zip(ref_l, cap_l)]
-    delta_s_perc_data = [delta_perc(ref, cap) for ref, cap in zip(ref_s, cap_s)]
+  def get_hls_delta_stats(self):
+    return self.__accumulate_hls().get_stats()
 
-    return [
-        np.average(delta_h_perc_data),
-        np.average(delta_l_perc_data),
-        np.average(delta_s_perc_data)
-    ]
+  def get_delta_e(self, method='2000'):
+    delta_e = []
+    for ref_chunk, cap_chunk in zip(self.__ref_color.iter_chunks(),
+                                    self.__cap_color.iter_chunks()):
+      lab = []
+      for chunk in [ref_chunk, cap_chunk]:
+        channels = chunk['channels']
+        values = np.column_stack([channels[channel] for channel in chunk['format']])
+        lab.append(to_lab(values, chunk['format']))
+      length = min(len(lab[0]), len(lab[1]))
+      delta_e.append(get_delta_e(lab[0][:length], lab[1][:length], method))
+    return np.concatenate(delta_e) if delta_e else np.empty(0)
@@ -9,34 +9,95 @@ import ip.draw
 import ip.graph
 
 
+def convert_color(img, color_format):
+  conversions = {
+      'rgb': cv2.COLOR_BGR2RGB,
+      'yuv': cv2.COLOR_BGR2YUV,
+      'hsv': cv2.COLOR_BGR2HSV,
+      'hls': cv2.COLOR_BGR2HLS
+  }
+  if color_format not in conversions:
+    raise AttributeError('convert_color: ' + color_format + ' not found')
+  return cv2.cvtColor(img, conversions[color_format])
+
+
 class ColorReader(metaclass=abc.ABCMeta):
+  # pylint: disable=too-many-instance-attributes
   def __init__(self, image_loader, filter_type):
-    rect_color = (0, 0, 255)
     self.__window = 'ColorScope'
-    self._img = image_loader.imread()
+    self.__rect_color = (0, 0, 255)
     self._filter = ip.colorfilter.create(filter_type)
-    if self._img is None:
-      raise AttributeError('ColorReader.__init__: image load failed')
-
-    self._img_mark = self._img.copy()
-    self.__drawer = ip.draw.RectDrawer(self.__window, self._img, rect_color)
     self.__rect = [[0, 0], [0, 0]]
+    self.__drawer = None
     self._color_json = None
+    self.set_image(image_loader.imread())
 
+  @staticmethod
   @abc.abstractmethod
-  def _get_color_format(self, img_roi):
+  def _get_color_format():
     pass
 
-  def read_rect_color(self, rect):
+  def set_image(self, img):
+    if img is None:
+      raise AttributeError('ColorReader.set_image: image load failed')
+    self._img = img
+    self.__frames = {}
+    self.__integrals = {}
+    self.__frame_areas = {}
+    self.__integral_areas = {}
+
+  def _get_frame(self, color_format):
+    if color_format not in self.__frames:
+      self.__frames[color_format] = convert_color(self._img, color_format)
+    return self.__frames[color_format]
+
+  def _get_integral(self, color_format):
+    if color_format not in self.__integrals:
+      self.__integrals[color_format] = ip.colorfilter.IntegralImage(self._get_frame(color_format))
+    return self.__integrals[color_format]
+
+  def __get_roi_area(self, min_x, min_y, max_x, max_y):
+    height, width = self._img.shape[:2]
+    y_0, y_1, _ = slice(min_y, max_y).indices(height)
+    x_0, x_1, _ = slice(min_x, max_x).indices(width)
+    return max(0, y_1 - y_0) * max(0, x_1 - x_0)
+
+  def __is_full_frame_worth(self, cache, roi_areas, color_format, roi_area):
+    if color_format in cache:
+      return True
+    roi_areas[color_format] = roi_areas.get(color_format, 0) + roi_area
+    return roi_areas[color_format] > self._img.shape[0] * self._img.shape[1]
+
+  def read_rect_color(self, rect, color_format=None):
+    if color_format is None:
+      color_format = self._get_color_format()
+
     p1_x, p1_y = [rect[0][0], rect[0][1]]
     p2_x, p2_y = [rect[1][0], rect[1][1]]
 
     min_x, min_y = [min(p1_x, p2_x), min(p1_y, p2_y)]
     max_x, max_y = [max(p1_x, p2_x), max(p1_y, p2_y)]
 
-    roi = self._img[min_y:max_y, min_x:max_x]
+    roi_area = self.__get_roi_area(min_x, min_y, max_x, max_y)
+    if roi_area == 0:
+      raise ValueError('ColorReader: empty roi')
+    if isinstance(self._filter, ip.colorfilter.ColorChannelFilterAverage) and \
+       self.__is_full_frame_worth(self.__integrals, self.__integral_areas, color_format, roi_area):
+      return self._get_integral(color_format).average(min_x, min_y, max_x, max_y)
+
+    if self.__is_full_frame_worth(self.__frames, self.__frame_areas, color_format, roi_area):
+      roi = self._get_frame(color_format)[min_y:max_y, min_x:max_x]
+    else:
+      roi = convert_color(self._img[min_y:max_y, min_x:max_x], color_format)
+
+    return self._filter.filter(roi)
 
-    return self._filter.filter(self._get_color_format(roi))
+  def read_rect_colors(self, rect, color_formats):
+    return {color_format: self.read_rect_color(rect, color_format)
+            for color_format in color_formats}
+
+  def write(self):
+    self._color_json.write()
 
   def __on_mouse_event(self, event, x, y, flags, param):
     del flags, param
@@ -56,10 +117,12 @@ class ColorReader(metaclass=abc.ABCMeta):
         print('\t'.join(map(str, color)))
 
   def processing(self):
+    print(*self._get_color_format().upper(), sep='\t')
+    self.__drawer = ip.draw.RectDrawer(self.__window, self._img.copy(), self.__rect_color)
     cv2.imshow(self.__window, self._img)
     cv2.setMouseCallback(self.__window, self.__on_mouse_event)
     ip.graph.show_window(self.__window)
-    self._color_json.write()
+    self.write()
 
   @staticmethod
   def create(color_format, image_loader, filter_type, out_json_filename):
@@ -78,40 +141,40 @@ class ColorReaderRGB(ColorReader):
   def __init__(self, filename, json_filename, filter_type='avg'):
     super().__init__(filename, filter_type)
     self._color_json = ip.colorjson.JsonSerializerRGB(json_filename)
-    print('R', 'G', 'B', sep='\t')
 
-  def _get_color_format(self, img_roi):
-    return cv2.cvtColor(img_roi, cv2.COLOR_BGR2RGB)
+  @staticmethod
+  def _get_color_format():
+    return 'rgb'
 
 
 class ColorReaderYUV(ColorReader):
   def __init__(self, filename, json_filename, filter_type='avg'):
     super().__init__(filename, filter_type)
     self._color_json = ip.colorjson.JsonSerializerYUV(json_filename)
-    print('Y', 'U', 'V', sep='\t')
 
-  def _get_color_format(self, img_roi):
-    return cv2.cvtColor(img_roi, cv2.COLOR_BGR2YUV)
+  @staticmethod
+  def _get_color_format():
+    return 'yuv'
 
 
 class ColorReaderHSV(ColorReader):
   def __init__(self, filename, json_filename, filter_type='avg'):
     super().__init__(filename, filter_type)
     self._color_json = ip.colorjson.JsonSerializerHSV(json_filename)
-    print('H', 'S', 'V', sep='\t')
 
-  def _get_color_format(self, img_roi):
-    return cv2.cvtColor(img_roi, cv2.COLOR_BGR2HSV)
+  @staticmethod
+  def _get_color_format():
+    return 'hsv'
 
 
 class ColorReaderHLS(ColorReader):
   def __init__(self, filename, json_filename, filter_type='avg'):
     super().__init__(filename, filter_type)
     self._color_json = ip.colorjson.JsonSerializerHLS(json_filename)
-    print('H', 'L', 'S', sep='\t')
 
-  def _get_color_format(self, img_roi):
-    return cv2.cvtColor(img_roi, cv2.COLOR_BGR2HLS)
+  @staticmethod
+  def _get_color_format():
+    return 'hls'
 
 
 def create(color_format, img_loader, filter_type, out_json_filename):
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 """Plot generator"""
 
+import os
 import abc
+import tempfile
+import functools
+import itertools
+import concurrent.futures
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
 import ip.colorjson
 import ip.colormeter
 
@@ -39,6 +43,68 @@ def show_window(window):
   cv2.destroyAllWindows()
 
 
+HS_BACKGROUND_CACHE = {}
+
+
+def generate_hs_background():
+  hue, saturation = np.meshgrid(np.arange(Const.get_max_hue()),
+                                np.arange(Const.get_max_saturation()), indexing='ij')
+  img_hls = np.empty(hue.shape + (3,), np.uint8)
+  img_hls[:, :, 0] = hue
+  img_hls[:, :, 1] = Const.get_max_lightness() // 2
+  img_hls[:, :, 2] = saturation
+  return cv2.cvtColor(img_hls, cv2.COLOR_BGR2RGB)
+
+
+def save_hs_background(background_filename, img):
+  background_dir = os.path.dirname(os.path.abspath(background_filename))
+  temp_fd, temp_filename = tempfile.mkstemp(suffix='.npy', dir=background_dir)
+  try:
+    with os.fdopen(temp_fd, 'wb') as background_file:
+      np.save(background_file, img)
+    os.replace(temp_filename, background_filename)
+  except OSError:
+    os.remove(temp_filename)
+    raise
+
+
+def load_hs_background(background_filename):
+  shape = (Const.get_max_hue(), Const.get_max_saturation(), 3)
+  try:
+    img = np.load(background_filename, allow_pickle=False)
+  except (OSError, ValueError, EOFError):
+    img = None
+  if img is None or img.shape != shape or img.dtype != np.uint8:
+    img = generate_hs_background()
+    save_hs_background(background_filename, img)
+  return img
+
+
+def get_hs_background(background_filename=None):
+  if background_filename not in HS_BACKGROUND_CACHE:
+    if background_filename:
+      img = load_hs_background(background_filename)
+    else:
+      img = generate_hs_background()
+    img.setflags(write=False)
+    HS_BACKGROUND_CACHE[background_filename] = img
+  return HS_BACKGROUND_CACHE[background_filename]
+
+
+EXPORT_AXES = {}
+
+
+def get_export_axes():
+  # pylint: disable=import-outside-toplevel
+  if 'hs' not in EXPORT_AXES:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    EXPORT_AXES['hs'] = figure.add_subplot(1, 1, 1)
+  return EXPORT_AXES['hs']
+
+
 class Graph(metaclass=abc.ABCMeta):
   @abc.abstractmethod
   def show(self):
@@ -46,14 +112,17 @@ class Graph(metaclass=abc.ABCMeta):
 
 
 class GraphHS:
-  def __init__(self, ref_json_filename, cap_json_filename):
+  def __init__(self, ref_json_filename, cap_json_filename, background_filename=None,
+               density_threshold=10000):
     self.__ref_color = ip.colorjson.JsonDeserializer(ref_json_filename)
     self.__cap_color = ip.colorjson.JsonDeserializer(cap_json_filename)
     self.__title = 'HS Error graph'
     self.__xlabel = 'S'
     self.__ylabel = 'H'
+    self.__background_filename = background_filename
+    self.__density_threshold = density_threshold
 
-    if self.__ref_color.get()['format'] != 'hls' or self.__cap_color.get()['format'] != 'hls':
+    if self.__ref_color.get_format() != 'hls' or self.__cap_color.get_format() != 'hls':
       raise ValueError('Wrong format, HLS only supported (so far)')
 
   @staticmethod
@@ -64,22 +133,6 @@ class GraphHS:
   def __get_max_saturation():
     return Const.get_max_saturation()
 
-  @staticmethod
-  def __get_max_lightness():
-    return Const.get_max_lightness()
-
-  def __generate_hs(self):
-    img = np.zeros((self.__get_max_hue(), self.__get_max_saturation(), 3), np.uint8)
-    height, width, channels = img.shape
-    del channels
-    img_hls = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
-    lightness = int(self.__get_max_lightness()/2)
-    for y in range(0, height):
-      for x in range(0, width):
-        s_channel, h_channel = x, y
-        img_hls[y, x] = [h_channel, lightness, s_channel]
-    return img_hls
-
   def __print_stats(self):
     color_meter = ip.colormeter.ColorMeter(self.__ref_color, self.__cap_color)
     h_perc, l_perc, s_perc = color_meter.get_hls_delta_perc()
@@ -88,42 +141,106 @@ class GraphHS:
     print(Const.Symbols.delta() + 'L [average] : ', round(l_perc, 2), '%', sep='')
     print(Const.Symbols.delta() + 'S [average] : ', round(s_perc, 2), '%', sep='')
 
+  def __get_edges(self):
+    return [np.linspace(0, max_value - 1, 65)
+            for max_value in [self.__get_max_saturation(), self.__get_max_hue()]]
+
+  def __get_samples(self):
+    points = [[], []]
+    counts = [0, 0]
+    histograms = None
+    edges = self.__get_edges()
+    for chunks in itertools.zip_longest(self.__ref_color.iter_chunks(),
+                                        self.__cap_color.iter_chunks()):
+      for i, chunk in enumerate(chunks):
+        if chunk is not None:
+          points[i].append(np.column_stack([chunk['channels']['s'], chunk['channels']['h']]))
+          counts[i] += len(points[i][-1])
+      if histograms is None and max(counts) > self.__density_threshold:
+        histograms = [np.zeros((len(edges[0]) - 1, len(edges[1]) - 1)) for _ in points]
+      if histograms is not None:
+        for histogram, series in zip(histograms, points):
+          for chunk_points in series:
+            histogram += np.histogram2d(chunk_points[:, 0], chunk_points[:, 1], bins=edges)[0]
+          del series[:]
+    if histograms is not None:
+      return None, histograms
+    ref_points, cap_points = [np.concatenate(series) if series else np.empty((0, 2))
+                              for series in points]
+    length = min(len(ref_points), len(cap_points))
+    return (ref_points[:length], cap_points[:length]), None
+
+  def draw_background(self, axes):
+    axes.set_ylim((0, self.__get_max_hue() - 1))
+    axes.set_xlim(0, self.__get_max_saturation() - 1)
+    axes.set_title(self.__title)
+    axes.set_xlabel(self.__xlabel)
+    axes.set_ylabel(self.__ylabel)
+    axes.imshow(get_hs_background(self.__background_filename))
+
+    ref_legend, = axes.plot([], 'bs-', label='ref')
+    cap_legend, = axes.plot([], 'ro-', label='cap')
+    axes.legend(handles=[ref_legend, cap_legend])
+
+  def draw_samples(self, axes):
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.collections import LineCollection
+    points, histograms = self.__get_samples()
+    if histograms is not None:
+      s_edges, h_edges = self.__get_edges()
+      return [axes.pcolormesh(s_edges, h_edges, np.ma.masked_equal(histogram.T, 0), cmap=cmap,
+                              alpha=0.6)
+              for histogram, cmap in zip(histograms, ['Blues', 'Reds'])]
+    ref_points, cap_points = points
+    return [
+        axes.add_collection(LineCollection(np.stack([ref_points, cap_points], axis=1),
+                                           colors='black', linewidths=0.7), autolim=False),
+        axes.scatter(ref_points[:, 0], ref_points[:, 1], c='b', marker='s'),
+        axes.scatter(cap_points[:, 0], cap_points[:, 1], c='r', marker='o')
+    ]
+
+  def draw(self, axes):
+    self.draw_background(axes)
+    return self.draw_samples(axes)
+
   def show(self):
+    # pylint: disable=import-outside-toplevel
+    import matplotlib.pyplot as plt
     self.__print_stats()
-    img = self.__generate_hs()
-
-    plt.ylim((0, self.__get_max_hue() - 1))
-    plt.xlim(0, self.__get_max_saturation() - 1)
-    plt.title(self.__title)
-    plt.xlabel(self.__xlabel)
-    plt.ylabel(self.__ylabel)
-    plt.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-
-    ref_point_color = 'bs-'
-    cap_point_color = 'ro-'
+    self.draw(plt.gca())
+    plt.show()
 
-    for i in range(len(self.__ref_color.get()['channels']['h'])):
-      p1_x, p1_y = [
-          self.__ref_color.get()['channels']['s'][i],
-          self.__ref_color.get()['channels']['h'][i]
-      ]
+  def export(self, out_filename):
+    axes = get_export_axes()
+    if not axes.images:
+      self.draw_background(axes)
+    artists = self.draw_samples(axes)
+    try:
+      axes.figure.savefig(out_filename)
+    finally:
+      for artist in artists:
+        artist.remove()
 
-      p2_x, p2_y = [
-          self.__cap_color.get()['channels']['s'][i],
-          self.__cap_color.get()['channels']['h'][i]
-      ]
+  @staticmethod
+  def create(ref_json_filename, cap_json_filename, background_filename=None,
+             density_threshold=10000):
+    graph_hs = GraphHS(ref_json_filename, cap_json_filename, background_filename,
+                       density_threshold)
+    graph_hs.show()
 
-      plt.plot([p1_x, p2_x], [p1_y, p2_y], color='black', linewidth=0.7)
-      plt.plot([p1_x, p1_x], [p1_y, p1_y], ref_point_color)
-      plt.plot([p2_x, p2_x], [p2_y, p2_y], cap_point_color)
 
-    ref_legend, = plt.plot([], ref_point_color, label='ref')
-    cap_legend, = plt.plot([], cap_point_color, label='cap')
+def export_graph(graph_filenames, background_filename=None, density_threshold=10000):
+  ref_json_filename, cap_json_filename, out_filename = graph_filenames
+  graph_hs = GraphHS(ref_json_filename, cap_json_filename, background_filename,
+                     density_threshold)
+  graph_hs.export(out_filename)
+  return out_filename
 
-    plt.legend(handles=[ref_legend, cap_legend])
-    plt.show()
 
-  @staticmethod
-  def create(ref_json_filename, cap_json_filename):
-    graph_hs = GraphHS(ref_json_filename, cap_json_filename)
-    graph_hs.show()
+def export_graphs(graphs_filenames, jobs=1, background_filename=None, density_threshold=10000):
+  export = functools.partial(export_graph, background_filename=background_filename,
+                             density_threshold=density_threshold)
+  if jobs > 1 and len(graphs_filenames) > 1:
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+      return list(executor.map(export, graphs_filenames))
+  return [export(graph_filenames) for graph_filenames in graphs_filenames]
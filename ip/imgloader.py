@@ -7,8 +7,11 @@ import cv2
 
 
 class ImageLoader(metaclass=abc.ABCMeta):
+  def __init__(self):
+    self._frame_idx = 0
+
   @abc.abstractmethod
-  def imread(self):
+  def imread(self, frame_idx=None):
     pass
 
   @staticmethod
@@ -24,55 +27,117 @@ class ImageLoader(metaclass=abc.ABCMeta):
     raise AttributeError('image_loader_factory: ' + pixel_format + ' not found')
 
   @abc.abstractmethod
-  def get_native_channels(self):
+  def get_native_channels(self, frame_idx=None):
     pass
 
+  @abc.abstractmethod
+  def get_planes(self, frame_idx=None):
+    pass
+
+  def __len__(self):
+    return 1
+
+  def __iter__(self):
+    for frame_idx in range(len(self)):
+      yield self.imread(frame_idx)
+
+  def _get_frame_idx(self, frame_idx):
+    if frame_idx is None:
+      return self._frame_idx
+    if not 0 <= frame_idx < len(self):
+      raise IndexError('ImageLoader: frame ' + str(frame_idx) + ' out of range')
+    return frame_idx
+
+  def seek(self, frame_idx):
+    self._frame_idx = self._get_frame_idx(frame_idx)
+
 
 class ImageLoaderDefault(ImageLoader):
   def __init__(self, filename):
+    super().__init__()
     self.__filename = filename
 
-  def imread(self):
+  def imread(self, frame_idx=None):
+    self._get_frame_idx(frame_idx)
     return cv2.imread(self.__filename)
 
-  def get_native_channels(self):
-    return self.imread()
+  def get_native_channels(self, frame_idx=None):
+    return self.imread(frame_idx)
+
+  def get_planes(self, frame_idx=None):
+    img_yuv = cv2.cvtColor(self.imread(frame_idx), cv2.COLOR_BGR2YUV)
+    return img_yuv[:, :, 0], img_yuv[:, :, 1], img_yuv[:, :, 2]
 
 
 class ImageLoaderRawNV21(ImageLoader):
   def __init__(self, filename, size):
+    super().__init__()
     width, height = size
-    self.__frame_len = width * height * 3 / 2
-    self.__img_file = open(filename, 'rb')
+    self.__filename = filename
+    self.__size = size
+    self.__frame_len = int(width * height * 3 / 2)
+    self.__raw = np.memmap(filename, dtype=np.uint8, mode='r')
     self.__shape = (int(height * 1.5), width)
+    if len(self.__raw) < self.__frame_len:
+      raise ValueError('ImageLoaderRaw: ' + filename + ' smaller than one frame')
 
-  def _read_raw(self):
-    raw = self.__img_file.read(int(self.__frame_len))
-    buf = np.frombuffer(raw, dtype=np.uint8)
+  def __len__(self):
+    return len(self.__raw) // self.__frame_len
+
+  def __reduce__(self):
+    return (self.__class__, (self.__filename, self.__size), {'_frame_idx': self._frame_idx})
+
+  def _read_raw(self, frame_idx=None):
+    offset = self._get_frame_idx(frame_idx) * self.__frame_len
+    buf = self.__raw[offset:offset + self.__frame_len]
     raw_img = buf.reshape(self.__shape)
     return raw_img
 
-  def imread(self):
-    raw_img = self._read_raw()
+  @staticmethod
+  def _split_chroma(raw_chroma):
+    return raw_chroma[:, 1::2], raw_chroma[:, 0::2]
+
+  def imread(self, frame_idx=None):
+    raw_img = self._read_raw(frame_idx)
     return cv2.cvtColor(raw_img, cv2.COLOR_YUV2BGR_NV21)
 
-  def get_native_channels(self):
-    bgr_converted_yuv = self.imread()
-    return cv2.cvtColor(bgr_converted_yuv, cv2.COLOR_BGR2YUV)
+  def get_planes(self, frame_idx=None):
+    raw_img = self._read_raw(frame_idx)
+    height = self.__size[1]
+    plane_u, plane_v = self._split_chroma(raw_img[height:])
+    return raw_img[:height], plane_u, plane_v
+
+  def get_native_channels(self, frame_idx=None):
+    plane_y, plane_u, plane_v = self.get_planes(frame_idx)
+    height, width = plane_y.shape
+    img_yuv = np.empty((height, width, 3), np.uint8)
+    img_yuv[:, :, 0] = plane_y
+    for channel, plane in [(1, plane_u), (2, plane_v)]:
+      for y in range(2):
+        for x in range(2):
+          img_yuv[y::2, x::2, channel] = plane
+    return img_yuv
 
 
 class ImageLoaderRawNV12(ImageLoaderRawNV21):
-  def imread(self):
-    raw_img = self._read_raw()
+  @staticmethod
+  def _split_chroma(raw_chroma):
+    return raw_chroma[:, 0::2], raw_chroma[:, 1::2]
+
+  def imread(self, frame_idx=None):
+    raw_img = self._read_raw(frame_idx)
     return cv2.cvtColor(raw_img, cv2.COLOR_YUV2BGR_NV12)
 
-  def get_native_channels(self):
-    bgr_converted_yuv = self.imread()
-    return cv2.cvtColor(bgr_converted_yuv, cv2.COLOR_BGR2YUV)
 
 class ImageLoaderRawI420(ImageLoaderRawNV21):
-  def imread(self):
-    raw_img = self._read_raw()
+  @staticmethod
+  def _split_chroma(raw_chroma):
+    height, width = raw_chroma.shape
+    planes = raw_chroma.reshape(2, height, width // 2)
+    return planes[0], planes[1]
+
+  def imread(self, frame_idx=None):
+    raw_img = self._read_raw(frame_idx)
     return cv2.cvtColor(raw_img, cv2.COLOR_YUV2BGR_I420)
 
 
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 """Quality measurement"""
 import abc
+import os
+import itertools
+import threading
+import concurrent.futures
 from enum import IntEnum
 import numpy as np
-from skimage.measure import compare_ssim as ssim
+import cv2
 
 
 class ChannelsRGB(IntEnum):
@@ -18,71 +22,558 @@ class ChannelsYUV(IntEnum):
   V = 2
 
 
+def ssim(*args, **kwargs):
+  # pylint: disable=import-outside-toplevel
+  from skimage.measure import compare_ssim
+  return compare_ssim(*args, **kwargs)
+
+
+class SquareErrorKernel:
+  def __init__(self, block_size=1 << 20):
+    self.__block_size = block_size
+    self.__peak_bytes = 0
+    self.__peak_lock = threading.Lock()
+
+  def get_peak_bytes(self):
+    return self.__peak_bytes
+
+  @staticmethod
+  def __get_work_dtype(image_ref, image_cap):
+    if image_ref.dtype.itemsize == 1 and image_cap.dtype.itemsize == 1 and \
+       np.issubdtype(image_ref.dtype, np.integer) and np.issubdtype(image_cap.dtype, np.integer):
+      return np.int32
+    return np.float64
+
+  def channel_sums(self, image_ref, image_cap):
+    if image_ref.ndim == 2:
+      image_ref = image_ref[:, :, np.newaxis]
+      image_cap = image_cap[:, :, np.newaxis]
+    height, width, num_channels = image_ref.shape
+    block_rows = max(1, min(height, self.__block_size // max(1, width * num_channels)))
+    block = np.empty((block_rows, width, num_channels), self.__get_work_dtype(image_ref, image_cap))
+    with self.__peak_lock:
+      self.__peak_bytes = max(self.__peak_bytes, block.nbytes)
+    sums = np.zeros(num_channels, np.int64 if block.dtype == np.int32 else np.float64)
+    for row in range(0, height, block_rows):
+      rows = min(block_rows, height - row)
+      diff = block[:rows]
+      np.subtract(image_ref[row:row + rows], image_cap[row:row + rows], out=diff,
+                  dtype=diff.dtype)
+      np.square(diff, out=diff)
+      sums += diff.sum(axis=(0, 1), dtype=sums.dtype)
+    return sums
+
+  def channel_mean(self, image_ref, image_cap):
+    area = image_ref.shape[0] * image_ref.shape[1]
+    return self.channel_sums(image_ref, image_cap) / float(area)
+
+  def mean(self, image_ref, image_cap):
+    return float(self.channel_mean(image_ref, image_cap).mean())
+
+
+SQUARE_ERROR_KERNEL = SquareErrorKernel()
+
+
+def get_square_error_peak_bytes():
+  return SQUARE_ERROR_KERNEL.get_peak_bytes()
+
+
+class SSIMTiledKernel:
+  def __init__(self, tile_size=512, jobs=1, win_size=7):
+    self.__tile_size = tile_size
+    self.__jobs = jobs
+    self.__win_size = win_size
+
+  def __filter(self, img):
+    return cv2.blur(img, (self.__win_size, self.__win_size)).reshape(img.shape)
+
+  def __get_cov_norm(self):
+    num_points = self.__win_size ** 2
+    return num_points / (num_points - 1.0)
+
+  def get_moments(self, i_mat):
+    ux = self.__filter(i_mat)
+    vx = self.__get_cov_norm() * (self.__filter(i_mat * i_mat) - ux * ux)
+    return ux, vx
+
+  def get_ssim_map(self, i_mat, k_mat, ref_moments=None):
+    data_range, k_1, k_2 = 255, 0.01, 0.03
+    ux, vx = ref_moments if ref_moments is not None else self.get_moments(i_mat)
+    uy, vy = self.get_moments(k_mat)
+    vxy = self.__get_cov_norm() * (self.__filter(i_mat * k_mat) - ux * uy)
+    c_1 = (k_1 * data_range) ** 2
+    c_2 = (k_2 * data_range) ** 2
+    return ((2 * ux * uy + c_1) * (2 * vxy + c_2)) / ((ux * ux + uy * uy + c_1) * (vx + vy + c_2))
+
+  def get_halo(self):
+    return self.__win_size // 2
+
+  def crop_mean(self, ssim_map):
+    pad = self.get_halo()
+    return float(ssim_map[pad:-pad, pad:-pad].mean())
+
+  def __tile_sum(self, image_ref, image_cap, tile):
+    min_y, max_y, min_x, max_x = tile
+    pad = self.__win_size // 2
+    i_mat = image_ref[min_y - pad:max_y + pad, min_x - pad:max_x + pad].astype(np.float64)
+    k_mat = image_cap[min_y - pad:max_y + pad, min_x - pad:max_x + pad].astype(np.float64)
+    return self.get_ssim_map(i_mat, k_mat)[pad:-pad, pad:-pad].sum()
+
+  def get_tiles(self, height, width):
+    pad = self.__win_size // 2
+    return [(y, min(y + self.__tile_size, height - pad), x, min(x + self.__tile_size, width - pad))
+            for y in range(pad, height - pad, self.__tile_size)
+            for x in range(pad, width - pad, self.__tile_size)]
+
+  def mean(self, image_ref, image_cap):
+    if image_ref.ndim == 2:
+      image_ref = image_ref[:, :, np.newaxis]
+      image_cap = image_cap[:, :, np.newaxis]
+    height, width, num_channels = image_ref.shape
+    if min(height, width) < self.__win_size:
+      raise ValueError('SSIMTiledKernel: image smaller than ' + str(self.__win_size) + ' pixels')
+    tiles = self.get_tiles(height, width)
+    if self.__jobs > 1 and len(tiles) > 1:
+      with concurrent.futures.ThreadPoolExecutor(self.__jobs) as executor:
+        tile_sums = list(executor.map(
+            lambda tile: self.__tile_sum(image_ref, image_cap, tile), tiles))
+    else:
+      tile_sums = [self.__tile_sum(image_ref, image_cap, tile) for tile in tiles]
+    pad = self.__win_size // 2
+    return float(np.sum(tile_sums)) / ((height - 2 * pad) * (width - 2 * pad) * num_channels)
+
+
+def get_psnr(mean_square_error, channel_max_value=255):
+  if mean_square_error == 0:
+    return np.inf
+  return 10 * np.log10((np.square(channel_max_value))/mean_square_error)
+
+
+def get_json_value(value):
+  if isinstance(value, dict):
+    return {key: get_json_value(val) for key, val in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [get_json_value(val) for val in value]
+  if isinstance(value, float) and not np.isfinite(value):
+    return None
+  return value
+
+
 class  QualityMeasurement(metaclass=abc.ABCMeta):
   @staticmethod
-  def create(img_loader_ref, img_loader_cap, measurement_method=''):
+  def get_measurement(measurement_method=''):
+    # pylint: disable=too-many-return-statements
     if measurement_method == 'ssim-sc':
-      return QualityMeasurementSSIMsingleChannel(img_loader_ref, img_loader_cap)
+      return QualityMeasurementSSIMsingleChannel
     if measurement_method == 'ssim':
-      return QualityMeasurementSSIM(img_loader_ref, img_loader_cap)
+      return QualityMeasurementSSIM
     if measurement_method == 'psnr':
-      return QualityMeasurementPSNR(img_loader_ref, img_loader_cap)
+      return QualityMeasurementPSNR
     if measurement_method == 'psnr-sc':
-      return QualityMeasurementPSNRsingleChannel(img_loader_ref, img_loader_cap)
+      return QualityMeasurementPSNRsingleChannel
+    if measurement_method == 'psnr-yuv':
+      return QualityMeasurementPSNRyuv
+    if measurement_method == 'ssim-yuv':
+      return QualityMeasurementSSIMyuv
+    if measurement_method == 'ssim-tiled':
+      return QualityMeasurementSSIMtiled
+    if measurement_method == 'ssim-tiled-sc':
+      return QualityMeasurementSSIMtiledSingleChannel
+    if measurement_method == 'mse':
+      return QualityMeasurementMSE
+    if measurement_method == 'mse-sc':
+      return QualityMeasurementMSEsingleChannel
     raise AttributeError('quality_measure_factory method {} not found'.format(measurement_method))
 
-  def __init__(self, img_loader_ref, img_loader_cap):
-    self._image_ref = img_loader_ref.get_native_channels()
-    self._image_cap = img_loader_cap.get_native_channels()
-    if self._image_ref is None or self._image_cap is None:
+  @staticmethod
+  def create(img_loader_ref, img_loader_cap, measurement_method=''):
+    if ',' in measurement_method:
+      return QualityMeasurementMulti(
+          img_loader_ref, img_loader_cap, measurement_method.split(','))
+    measurement = QualityMeasurement.get_measurement(measurement_method)
+    return measurement(img_loader_ref, img_loader_cap)
+
+  @staticmethod
+  def check_images(image_ref, image_cap):
+    if image_ref is None or image_cap is None:
       raise AttributeError('Incorrect input data files')
-    if self._image_ref.shape != self._image_cap.shape:
+    if image_ref.shape != image_cap.shape:
       raise AttributeError('Unmatching images size')
 
+  @staticmethod
+  def load(img_loader, frame_idx=None):
+    return img_loader.get_native_channels(frame_idx)
 
-class QualityMeasurementPSNRsingleChannel(QualityMeasurement):
   def __init__(self, img_loader_ref, img_loader_cap):
-    QualityMeasurement.__init__(self, img_loader_ref, img_loader_cap)
+    self._image_ref = self.load(img_loader_ref)
+    self._image_cap = self.load(img_loader_cap)
+    self.check_images(self._image_ref, self._image_cap)
 
-  def process(self, chan_no):
-    i_mat = self._image_ref[:, :, chan_no].astype(float)
-    k_mat = self._image_cap[:, :, chan_no].astype(float)
-    mean_square_error = (np.square(i_mat-k_mat)).mean()
-    channel_max_value = 255
-    if mean_square_error == 0:
-      return np.inf
-    return 10 * np.log10((np.square(channel_max_value))/mean_square_error)
+  @staticmethod
+  @abc.abstractmethod
+  def measure(image_ref, image_cap, *args):
+    pass
 
+  @classmethod
+  def measure_shared(cls, image_ref, image_cap, shared, *args):
+    # pylint: disable=unused-argument
+    return cls.measure(image_ref, image_cap, *args)
 
-class QualityMeasurementSSIMsingleChannel(QualityMeasurement):
-  def __init__(self, img_loader_ref, img_loader_cap):
-    QualityMeasurement.__init__(self, img_loader_ref, img_loader_cap)
+  def process(self, *args):
+    return self.measure(self._image_ref, self._image_cap, *args)
+
+
+class QualityMeasurementMSE(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap):
+    return SQUARE_ERROR_KERNEL.mean(image_ref, image_cap)
+
+  @staticmethod
+  def get_channel_mean(image_ref, image_cap, shared):
+    if 'channel_mse' not in shared:
+      shared['channel_mse'] = SQUARE_ERROR_KERNEL.channel_mean(image_ref, image_cap)
+    return shared['channel_mse']
 
-  def process(self, ch_no):
-    i_mat = self._image_ref[:, :, ch_no]
-    k_mat = self._image_cap[:, :, ch_no]
+  @classmethod
+  def measure_shared(cls, image_ref, image_cap, shared):
+    return float(cls.get_channel_mean(image_ref, image_cap, shared).mean())
+
+
+class QualityMeasurementMSEsingleChannel(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap, chan_no):
+    return SQUARE_ERROR_KERNEL.mean(image_ref[:, :, chan_no], image_cap[:, :, chan_no])
+
+  @classmethod
+  def measure_shared(cls, image_ref, image_cap, shared, chan_no):
+    return float(QualityMeasurementMSE.get_channel_mean(image_ref, image_cap, shared)[chan_no])
+
+
+class QualityMeasurementPSNRsingleChannel(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap, chan_no):
+    return get_psnr(QualityMeasurementMSEsingleChannel.measure(image_ref, image_cap, chan_no))
+
+  @classmethod
+  def measure_shared(cls, image_ref, image_cap, shared, chan_no):
+    return get_psnr(QualityMeasurementMSEsingleChannel.measure_shared(
+        image_ref, image_cap, shared, chan_no))
+
+
+class QualityMeasurementSSIMsingleChannel(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap, ch_no):
+    i_mat = image_ref[:, :, ch_no]
+    k_mat = image_cap[:, :, ch_no]
     return ssim(i_mat, k_mat)
 
 
 class QualityMeasurementSSIM(QualityMeasurement):
-  def __init__(self, img_loader_ref, img_loader_cap):
-    QualityMeasurement.__init__(self, img_loader_ref, img_loader_cap)
-
-  def process(self):
-    i_mat = self._image_ref
-    k_mat = self._image_cap
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap):
+    i_mat = image_ref
+    k_mat = image_cap
     return ssim(i_mat, k_mat, multichannel=True)
 
 
+class QualityMeasurementSSIMtiled(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap, tile_size=512, jobs=1):
+    return SSIMTiledKernel(tile_size, jobs).mean(image_ref, image_cap)
+
+
+class QualityMeasurementSSIMtiledSingleChannel(QualityMeasurement):
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap, ch_no, tile_size=512, jobs=1):
+    return SSIMTiledKernel(tile_size, jobs).mean(image_ref[:, :, ch_no], image_cap[:, :, ch_no])
+
+
 class QualityMeasurementPSNR(QualityMeasurement):
-  def __init__(self, img_loader_ref, img_loader_cap):
-    QualityMeasurement.__init__(self, img_loader_ref, img_loader_cap)
-
-  def process(self):
-    i_mat = self._image_ref.astype(float)
-    k_mat = self._image_cap.astype(float)
-    mean_square_error = np.sum(np.square(i_mat - k_mat))/float(i_mat.shape[0]*i_mat.shape[1])/3.0
-    if mean_square_error == 0:
-      return np.inf
-    channel_max_value = 255
-    return 10 * np.log10((np.square(channel_max_value))/mean_square_error)
+  # pylint: disable=arguments-differ
+  @staticmethod
+  def measure(image_ref, image_cap):
+    return get_psnr(QualityMeasurementMSE.measure(image_ref, image_cap))
+
+  @classmethod
+  def measure_shared(cls, image_ref, image_cap, shared):
+    return get_psnr(QualityMeasurementMSE.measure_shared(image_ref, image_cap, shared))
+
+
+class QualityMeasurementPlanes(QualityMeasurement):
+  @staticmethod
+  def load(img_loader, frame_idx=None):
+    return img_loader.get_planes(frame_idx)
+
+  @staticmethod
+  def check_images(image_ref, image_cap):
+    if image_ref is None or image_cap is None:
+      raise AttributeError('Incorrect input data files')
+    if [plane.shape for plane in image_ref] != [plane.shape for plane in image_cap]:
+      raise AttributeError('Unmatching images size')
+
+  @staticmethod
+  def get_weighted(plane_values):
+    value_y, value_u, value_v = plane_values
+    return (6 * value_y + value_u + value_v) / 8.0
+
+  @staticmethod
+  @abc.abstractmethod
+  def measure_plane(plane_ref, plane_cap):
+    pass
+
+  @classmethod
+  def measure(cls, image_ref, image_cap):
+    # pylint: disable=arguments-differ
+    plane_values = [float(cls.measure_plane(plane_ref, plane_cap))
+                    for plane_ref, plane_cap in zip(image_ref, image_cap)]
+    return plane_values + [cls.get_weighted(plane_values)]
+
+
+class QualityMeasurementPSNRyuv(QualityMeasurementPlanes):
+  @staticmethod
+  def measure_plane(plane_ref, plane_cap):
+    return get_psnr(SQUARE_ERROR_KERNEL.mean(plane_ref, plane_cap))
+
+
+class QualityMeasurementSSIMyuv(QualityMeasurementPlanes):
+  @staticmethod
+  def measure_plane(plane_ref, plane_cap):
+    return ssim(plane_ref, plane_cap)
+
+
+class QualityMeasurementMulti:
+  def __init__(self, img_loader_ref, img_loader_cap, measurement_methods):
+    self.__measurements = [(method, QualityMeasurement.get_measurement(method))
+                           for method in measurement_methods]
+    self.__images = {}
+    for _, measurement in self.__measurements:
+      if measurement.load not in self.__images:
+        image_ref = measurement.load(img_loader_ref)
+        image_cap = measurement.load(img_loader_cap)
+        measurement.check_images(image_ref, image_cap)
+        self.__images[measurement.load] = (image_ref, image_cap)
+
+  def process(self, *args):
+    shared = {load: {} for load in self.__images}
+    values = {}
+    for method, measurement in self.__measurements:
+      image_ref, image_cap = self.__images[measurement.load]
+      values[method] = measurement.measure_shared(
+          image_ref, image_cap, shared[measurement.load], *args)
+    return values
+
+
+class QualityMeasurementBlocks:
+  def __init__(self, img_loader_ref, img_loader_cap, block_size=16):
+    if block_size < 1:
+      raise AttributeError('QualityMeasurementBlocks: block size ' + str(block_size))
+    self.__image_ref = QualityMeasurement.load(img_loader_ref)
+    self.__image_cap = QualityMeasurement.load(img_loader_cap)
+    QualityMeasurement.check_images(self.__image_ref, self.__image_cap)
+    if self.__image_ref.ndim == 2:
+      self.__image_ref = self.__image_ref[:, :, np.newaxis]
+      self.__image_cap = self.__image_cap[:, :, np.newaxis]
+    self.__block_size = block_size
+
+  def __get_block_sums(self, values):
+    height, width = values.shape[:2]
+    row_sums = np.add.reduceat(
+        values, np.arange(0, height, self.__block_size), axis=0, dtype=np.float64)
+    return np.add.reduceat(
+        row_sums, np.arange(0, width, self.__block_size), axis=1).sum(axis=2)
+
+  def __get_block_means(self, band_sums):
+    height, width, num_channels = self.__image_ref.shape
+    block_rows = np.diff(np.append(np.arange(0, height, self.__block_size), height))
+    block_cols = np.diff(np.append(np.arange(0, width, self.__block_size), width))
+    return np.concatenate(band_sums) / (np.outer(block_rows, block_cols) * num_channels)
+
+  def __get_bands(self):
+    band_rows = self.__block_size * max(1, 256 // self.__block_size)
+    return [(row, min(row + band_rows, self.__image_ref.shape[0]))
+            for row in range(0, self.__image_ref.shape[0], band_rows)]
+
+  def get_mse_map(self):
+    band_sums = []
+    for min_y, max_y in self.__get_bands():
+      diff = np.subtract(self.__image_ref[min_y:max_y], self.__image_cap[min_y:max_y],
+                         dtype=np.int32)
+      band_sums.append(self.__get_block_sums(np.square(diff, out=diff)))
+    return self.__get_block_means(band_sums)
+
+  def get_ssim_map(self):
+    kernel = SSIMTiledKernel()
+    halo = kernel.get_halo()
+    height = self.__image_ref.shape[0]
+    band_sums = []
+    for min_y, max_y in self.__get_bands():
+      halo_y = min(min_y, halo)
+      rows = slice(min_y - halo_y, min(max_y + halo, height))
+      ssim_map = kernel.get_ssim_map(self.__image_ref[rows].astype(np.float64),
+                                     self.__image_cap[rows].astype(np.float64))
+      band_sums.append(self.__get_block_sums(ssim_map[halo_y:halo_y + max_y - min_y]))
+    return self.__get_block_means(band_sums)
+
+  def process(self, measurement_method='psnr'):
+    if measurement_method == 'mse':
+      return self.get_mse_map()
+    if measurement_method == 'psnr':
+      with np.errstate(divide='ignore'):
+        return 10 * np.log10(np.square(255.0) / self.get_mse_map())
+    if measurement_method == 'ssim':
+      return self.get_ssim_map()
+    raise AttributeError('QualityMeasurementBlocks: method {} not found'.format(measurement_method))
+
+  def get_worst_blocks(self, block_map, count, measurement_method='psnr'):
+    order = block_map.ravel() if measurement_method != 'mse' else -block_map.ravel()
+    count = min(count, order.size)
+    worst = np.argpartition(order, count - 1)[:count] if count > 0 else []
+    worst = sorted(worst, key=lambda idx: (order[idx], idx))
+    block_cols = block_map.shape[1]
+    return [(int(idx % block_cols) * self.__block_size, int(idx // block_cols) * self.__block_size,
+             float(block_map.flat[idx])) for idx in worst]
+
+  def write(self, block_map, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+      np.save(filename, block_map)
+      return
+    if ext != '.png':
+      raise ValueError('QualityMeasurementBlocks: ' + filename + ' is not .npy or .png')
+    finite = np.isfinite(block_map)
+    values = np.where(finite, block_map, block_map[finite].max() if finite.any() else 0)
+    value_range = max(values.max() - values.min(), 1e-12)
+    img = np.uint8(np.round(255 * (values - values.min()) / value_range))
+    img = cv2.applyColorMap(img, cv2.COLORMAP_JET)
+    height, width = self.__image_ref.shape[:2]
+    img = np.repeat(np.repeat(img, self.__block_size, axis=0), self.__block_size, axis=1)
+    cv2.imwrite(filename, img[:height, :width])
+
+
+class ReferenceContext:
+  def __init__(self, img_loader_ref):
+    self.__img_loader_ref = img_loader_ref
+    self.__images = {}
+    self.__ssim_kernel = SSIMTiledKernel()
+    self.__ssim_moments = None
+
+  def get_image(self, load=QualityMeasurement.load):
+    if load not in self.__images:
+      self.__images[load] = load(self.__img_loader_ref)
+    return self.__images[load]
+
+  def get_ssim_moments(self):
+    if self.__ssim_moments is None:
+      i_mat = self.get_image().astype(np.float64)
+      self.__ssim_moments = (i_mat,) + self.__ssim_kernel.get_moments(i_mat)
+    return self.__ssim_moments
+
+  def measure_ssim(self, image_cap, ch_no=None):
+    i_mat, ux, vx = self.get_ssim_moments()
+    k_mat = image_cap.astype(np.float64)
+    if ch_no is not None:
+      i_mat, ux, vx, k_mat = [mat[:, :, ch_no] for mat in [i_mat, ux, vx, k_mat]]
+    return self.__ssim_kernel.crop_mean(self.__ssim_kernel.get_ssim_map(i_mat, k_mat, (ux, vx)))
+
+  def process(self, img_loader_cap, measurement_method, *args):
+    images_cap = {}
+    shared = {}
+    values = {}
+    for method in measurement_method.split(','):
+      measurement = QualityMeasurement.get_measurement(method)
+      image_ref = self.get_image(measurement.load)
+      if measurement.load not in images_cap:
+        images_cap[measurement.load] = measurement.load(img_loader_cap)
+        measurement.check_images(image_ref, images_cap[measurement.load])
+        shared[measurement.load] = {}
+      image_cap = images_cap[measurement.load]
+      if measurement is QualityMeasurementSSIM:
+        values[method] = self.measure_ssim(image_cap)
+      elif measurement is QualityMeasurementSSIMsingleChannel:
+        values[method] = self.measure_ssim(image_cap, *args)
+      else:
+        values[method] = measurement.measure_shared(
+            image_ref, image_cap, shared[measurement.load], *args)
+    if ',' not in measurement_method:
+      return values[measurement_method]
+    return values
+
+
+class SequenceSummary:
+  def __init__(self):
+    self.__sum = 0.0
+    self.__finite_count = 0
+    self.__count = 0
+    self.__infinite_frames = 0
+    self.__min = np.inf
+    self.__worst_frame = None
+
+  def append(self, frame_idx, value):
+    value = np.asarray(value, dtype=float)
+    finite = np.isfinite(value)
+    self.__sum = self.__sum + np.where(finite, value, 0)
+    self.__finite_count = self.__finite_count + finite
+    self.__count += 1
+    self.__infinite_frames += int(not finite.all())
+    if self.__worst_frame is None or value.flat[-1] < np.asarray(self.__min).flat[-1]:
+      self.__min = value
+      self.__worst_frame = frame_idx
+
+  def get(self):
+    if self.__count == 0:
+      raise ValueError('SequenceSummary: no frames measured')
+    with np.errstate(divide='ignore', invalid='ignore'):
+      mean = np.where(self.__finite_count > 0, self.__sum / self.__finite_count, self.__min)
+    return {
+        'frames': self.__count,
+        'mean': mean.tolist(),
+        'min': self.__min.tolist(),
+        'worst_frame': self.__worst_frame,
+        'infinite_frames': self.__infinite_frames
+    }
+
+
+class QualityMeasurementSequence:
+  def __init__(self, img_loader_ref, img_loader_cap, measurement_method, frames=slice(None)):
+    self.__measurement = QualityMeasurement.get_measurement(measurement_method)
+    if len(img_loader_ref) != len(img_loader_cap):
+      raise AttributeError('Unmatching number of frames')
+    self.__img_loader_ref = img_loader_ref
+    self.__img_loader_cap = img_loader_cap
+    self.__frame_ids = range(len(img_loader_ref))[frames]
+
+  @staticmethod
+  def measure_frame(measurement, img_loader_ref, img_loader_cap, frame_idx, args):
+    image_ref = measurement.load(img_loader_ref, frame_idx)
+    image_cap = measurement.load(img_loader_cap, frame_idx)
+    measurement.check_images(image_ref, image_cap)
+    return frame_idx, measurement.measure(image_ref, image_cap, *args)
+
+  def process_frames(self, *args, jobs=1):
+    if jobs > 1 and len(self.__frame_ids) > 1:
+      with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(
+            self.measure_frame,
+            itertools.repeat(self.__measurement),
+            itertools.repeat(self.__img_loader_ref),
+            itertools.repeat(self.__img_loader_cap),
+            self.__frame_ids,
+            itertools.repeat(args)
+        )
+      return
+    for frame_idx in self.__frame_ids:
+      yield self.measure_frame(
+          self.__measurement, self.__img_loader_ref, self.__img_loader_cap, frame_idx, args)
+
+  def process(self, *args, jobs=1):
+    summary = SequenceSummary()
+    for frame_idx, value in self.process_frames(*args, jobs=jobs):
+      summary.append(frame_idx, value)
+    return summary.get()
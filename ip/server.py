@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Warm process running compare and sample jobs given as json lines"""
+
+import os
+import json
+import signal
+import socketserver
+import threading
+import concurrent.futures
+import ip.batchreader
+import ip.imgloader
+import ip.qualitymeasurement
+
+
+def parse_video_size(video_size):
+  if not video_size:
+    return None
+  if isinstance(video_size, str):
+    video_size = video_size.split('x', 1)
+  width, height = video_size
+  return int(width), int(height)
+
+
+def create_loader(job, filename_key):
+  img_loader = ip.imgloader.create(
+      job[filename_key], job.get('pixel_format', ''), parse_video_size(job.get('video_size')))
+  img_loader.seek(job.get('frame', 0))
+  return img_loader
+
+
+def run_compare(job):
+  metrics = job['metric'].split(',')
+  suffix, process_args = '', ()
+  if job.get('channel') is not None:
+    suffix, process_args = '-sc', (int(job['channel']),)
+  measurement = ip.qualitymeasurement.QualityMeasurement.create(
+      create_loader(job, 'ref'), create_loader(job, 'cap'),
+      ','.join(metric + suffix for metric in metrics))
+  metric_value = measurement.process(*process_args)
+  if len(metrics) == 1:
+    return metric_value
+  return {metric: metric_value[metric + suffix] for metric in metrics}
+
+
+def run_sample(job):
+  frame_idx = job.get('frame', 0)
+  batch_reader = ip.batchreader.BatchReader(
+      job.get('format', 'rgb'),
+      job.get('filter', 'avg'),
+      [ip.batchreader.parse_rect(roi) for roi in job['rois']],
+      job.get('pixel_format', ''),
+      parse_video_size(job.get('video_size')),
+      slice(frame_idx, frame_idx + 1)
+  )
+  return batch_reader.read_colors([job['image']])
+
+
+class LineWriter:
+  def __init__(self, stream, binary=False):
+    self.__stream = stream
+    self.__binary = binary
+    self.__lock = threading.Lock()
+
+  def write(self, record):
+    line = json.dumps(ip.qualitymeasurement.get_json_value(record), allow_nan=False) + '\n'
+    with self.__lock:
+      self.__stream.write(line.encode() if self.__binary else line)
+      self.__stream.flush()
+
+
+class ServerStopped(Exception):
+  pass
+
+
+class JobServer:
+  def __init__(self, jobs=1, max_pending=None):
+    self.__executor = concurrent.futures.ThreadPoolExecutor(max(1, jobs))
+    self.__pending = threading.BoundedSemaphore(max_pending or 4 * max(1, jobs))
+    self.__stopped = threading.Event()
+    self.__reading = threading.Event()
+    self.__commands = {'compare': run_compare, 'sample': run_sample}
+
+  def is_stopped(self):
+    return self.__stopped.is_set()
+
+  def wait_stopped(self, timeout=None):
+    return self.__stopped.wait(timeout)
+
+  def stop(self):
+    self.__stopped.set()
+
+  def is_reading(self):
+    return self.__reading.is_set()
+
+  def __read_line(self, lines):
+    self.__reading.set()
+    try:
+      return next(lines, None)
+    finally:
+      self.__reading.clear()
+
+  def run_job(self, job):
+    try:
+      command = self.__commands[job.get('cmd')]
+    except KeyError:
+      return {'id': job.get('id'), 'error': 'unknown cmd ' + str(job.get('cmd'))}
+    try:
+      return {'id': job.get('id'), 'result': command(job)}
+    except Exception as err:  # pylint: disable=broad-except
+      return {'id': job.get('id'), 'error': type(err).__name__ + ': ' + str(err)}
+
+  def __finish(self, future, writer):
+    self.__pending.release()
+    writer.write(future.result())
+
+  def submit(self, line, writer):
+    try:
+      job = json.loads(line)
+      if not isinstance(job, dict):
+        raise ValueError('job is not a json object')
+    except ValueError as err:
+      writer.write({'id': None, 'error': 'ValueError: ' + str(err)})
+      return None
+    if job.get('cmd') == 'shutdown':
+      self.stop()
+      writer.write({'id': job.get('id'), 'result': 'shutdown'})
+      return None
+    if self.is_stopped():
+      writer.write({'id': job.get('id'), 'error': 'ServerStopped: server stopped'})
+      return None
+    self.__pending.acquire()  # pylint: disable=consider-using-with
+    try:
+      future = self.__executor.submit(self.run_job, job)
+    except RuntimeError as err:
+      self.__pending.release()
+      writer.write({'id': job.get('id'), 'error': 'RuntimeError: ' + str(err)})
+      return None
+    future.add_done_callback(lambda done: self.__finish(done, writer))
+    return future
+
+  def serve_lines(self, lines, writer):
+    futures = []
+    lines = iter(lines)
+    while not self.is_stopped():
+      line = self.__read_line(lines)
+      if line is None:
+        break
+      if isinstance(line, bytes):
+        line = line.decode()
+      if line.strip():
+        futures.append(self.submit(line, writer))
+    concurrent.futures.wait([future for future in futures if future is not None])
+
+  def close(self):
+    self.stop()
+    self.__executor.shutdown(wait=True)
+
+
+class UnixJobHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    self.server.job_server.serve_lines(self.rfile, LineWriter(self.wfile, binary=True))
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socket_filename, job_server):
+    super().__init__(socket_filename, UnixJobHandler)
+    self.job_server = job_server
+
+
+def set_stop_signals(job_server, interrupt_read=False):
+  if threading.current_thread() is not threading.main_thread():
+    return {}
+
+  def stop(signum, frame):
+    del signum, frame
+    job_server.stop()
+    if interrupt_read and job_server.is_reading():
+      raise ServerStopped()
+
+  return {signum: signal.signal(signum, stop) for signum in [signal.SIGINT, signal.SIGTERM]}
+
+
+def restore_signals(handlers):
+  for signum, handler in handlers.items():
+    signal.signal(signum, handler)
+
+
+def serve_stdin(stdin, stdout, jobs=1):
+  job_server = JobServer(jobs)
+  handlers = set_stop_signals(job_server, interrupt_read=True)
+  try:
+    job_server.serve_lines(stdin, LineWriter(stdout))
+  except ServerStopped:
+    pass
+  finally:
+    job_server.close()
+    restore_signals(handlers)
+
+
+def serve_unix(socket_filename, jobs=1):
+  if os.path.exists(socket_filename):
+    raise FileExistsError('Socket :' + socket_filename + ' already exists')
+  job_server = JobServer(jobs)
+  unix_server = UnixServer(socket_filename, job_server)
+  handlers = set_stop_signals(job_server)
+  watcher = threading.Thread(target=lambda: (job_server.wait_stopped(), unix_server.shutdown()))
+  watcher.start()
+  try:
+    unix_server.serve_forever()
+  finally:
+    job_server.stop()
+    watcher.join()
+    unix_server.server_close()
+    job_server.close()
+    restore_signals(handlers)
+    os.remove(socket_filename)
@@ -1,11 +1,18 @@
 import unittest
+import io
+import json
+import socket
 import threading
 import os
+import signal
+import subprocess
 import sys
+import tracemalloc
 from time import sleep
 import matplotlib.pyplot as plt
 from PIL import Image
 from numpy import inf
+import numpy as np
 import cv2
 import ip
 
@@ -288,6 +295,48 @@ class TestImgLoader(unittest.TestCase):
       self.assertEqual([720, 1280], [h, w])
       self.assertEqual(3, channels)
 
+  def test_raw_memmap(self):
+    raw_filename = 'raw_memmap_test.yuv'
+    frames = np.random.RandomState(0).randint(0, 256, (2, 6, 8), np.uint8)
+    frames.tofile(raw_filename)
+    imloader = ip.imgloader.ImageLoaderRawNV12(raw_filename, (8, 4))
+    # pylint: disable=protected-access
+    raw_img = imloader._read_raw()
+    self.assertEqual((6, 8), raw_img.shape)
+    self.assertTrue(np.array_equal(frames[0], raw_img))
+    self.assertFalse(raw_img.flags['OWNDATA'])
+    img = imloader.imread(1)
+    self.assertTrue(np.array_equal(cv2.cvtColor(frames[1], cv2.COLOR_YUV2BGR_NV12), img))
+    del raw_img, imloader
+    os.remove(raw_filename)
+
+  def test_raw_frames(self):
+    raw_filename = 'raw_frames_test.yuv'
+    frames = np.random.RandomState(0).randint(0, 256, (5, 6, 8), np.uint8)
+    with open(raw_filename, 'wb') as raw_file:
+      raw_file.write(frames.tobytes() + bytes(10))
+    imloader = ip.imgloader.ImageLoaderRawI420(raw_filename, (8, 4))
+    self.assertEqual(5, len(imloader))
+    imgs = list(imloader)
+    self.assertEqual(5, len(imgs))
+    for frame, img in zip(frames, imgs):
+      self.assertTrue(np.array_equal(cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420), img))
+    self.assertTrue(np.array_equal(imgs[3], imloader.imread(3)))
+    self.assertTrue(np.array_equal(imgs[0], imloader.imread()))
+    imloader.seek(4)
+    self.assertTrue(np.array_equal(imgs[4], imloader.imread()))
+    with self.assertRaises(IndexError):
+      imloader.imread(5)
+    with self.assertRaises(IndexError):
+      imloader.seek(-1)
+    del imloader
+    os.remove(raw_filename)
+
+    imloader = ip.imgloader.create(self.res.red)
+    self.assertEqual(1, len(imloader))
+    with self.assertRaises(IndexError):
+      imloader.imread(1)
+
 
 # pylint: disable=too-many-public-methods
 class TestColorReader(unittest.TestCase):
@@ -462,6 +511,50 @@ class TestColorReader(unittest.TestCase):
     yuv = crm.read_rect_color(self.res.rect)
     self.assertEqual(yuv, [255, 128, 128])
 
+  def test_color_read_integral(self):
+    img_loader = ip.imgloader.ImageLoaderDefault('res/test_img/cat.png')
+    img = img_loader.imread()
+    crm = ColorReaderHlsMock(img_loader, 'test.json')
+    img_hls = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
+    for rect in [[[10, 20], [110, 70]], [[300, 400], [25, 5]], [[0, 0], [490, 733]]]:
+      (x1, y1), (x2, y2) = rect
+      roi = img_hls[min(y1, y2):max(y1, y2), min(x1, x2):max(x1, x2)]
+      hls = crm.read_rect_color(rect)
+      self.assertEqual(hls, [int(np.average(roi[:, :, i])) for i in range(3)])
+
+    with self.assertRaises(ValueError):
+      crm.read_rect_color([[5, 5], [5, 10]])
+
+    crm.set_image(cv2.imread(self.res.white))
+    self.assertEqual(crm.read_rect_color(self.res.rect), [0, 255, 0])
+
+  def test_color_read_roi_slices(self):
+    img_loader = ip.imgloader.ImageLoaderDefault('res/test_img/cat.png')
+    img = img_loader.imread()
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    for filter_type in ['avg', 'med']:
+      crm = ip.colorreader.ColorReaderHSV(img_loader, 'test.json', filter_type)
+      color_filter = ip.colorfilter.create(filter_type)
+      for rect in [[[10, 20], [110, 70]], [[0, 0], [490, 733]], [[10, 20], [110, 70]]]:
+        (x1, y1), (x2, y2) = rect
+        self.assertEqual(crm.read_rect_color(rect), color_filter.filter(img_hsv[y1:y2, x1:x2]))
+
+    with self.assertRaises(ValueError):
+      crm.read_rect_color([[600, 800], [700, 900]])
+
+  def test_color_read_formats(self):
+    img_loader = ip.imgloader.ImageLoaderDefault(self.res.red)
+    for filter_type in ['avg', 'med']:
+      crm = ip.colorreader.ColorReaderRGB(img_loader, 'test.json', filter_type)
+      colors = crm.read_rect_colors(self.res.rect, ['rgb', 'yuv', 'hsv', 'hls'])
+      self.assertEqual(colors['rgb'], [255, 0, 0])
+      self.assertEqual(colors['yuv'], [76, 91, 255])
+      self.assertEqual(colors['hsv'], [0, 255, 255])
+      self.assertEqual(colors['hls'], [0, 128, 255])
+      self.assertEqual(crm.read_rect_color(self.res.rect, 'hls'), [0, 128, 255])
+
+    with self.assertRaises(AttributeError):
+      crm.read_rect_color(self.res.rect, 'invalid')
 
 
 class TestColorFilter(unittest.TestCase):
@@ -538,6 +631,161 @@ class TestColorFilter(unittest.TestCase):
     r, g, b = color_filter.filter(cv2.imread(img_file))
     self.assertEqual([b, g, r], [255, 255, 255])
 
+  def test_color_filter_gradient(self):
+    img = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+    img[:, :, 2] = 7
+    median = ip.colorfilter.ColorChannelFilterMedian().filter(img)
+    average = ip.colorfilter.ColorChannelFilterAverage().filter(img)
+    self.assertEqual(median, [28, 29, 7])
+    self.assertEqual(average, [28, 29, 7])
+    self.assertEqual(median, [int(np.median(img[:, :, i])) for i in range(3)])
+    self.assertEqual(average, [int(np.average(img[:, :, i])) for i in range(3)])
+
+  def test_color_filter_histogram(self):
+    img = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+    img[0, 0:3, 2] = [9, 9, 9]
+    self.assertEqual(ip.colorfilter.create('p5').filter(img), [2, 3, 9])
+    self.assertEqual(ip.colorfilter.create('p95').filter(img), [54, 55, 56])
+    self.assertEqual(ip.colorfilter.create('p0').filter(img), [0, 1, 9])
+    self.assertEqual(ip.colorfilter.create('p100').filter(img), [57, 58, 59])
+    self.assertEqual(ip.colorfilter.create('trim10').filter(img), [28, 29, 30])
+    self.assertEqual(ip.colorfilter.create('mode').filter(img)[2], 9)
+
+    filtered = ip.colorfilter.filter_all(img, ['med', 'p50', 'avg'])
+    self.assertEqual(filtered['med'], filtered['p50'])
+    self.assertEqual(filtered['med'], [int(np.median(img[:, :, i])) for i in range(3)])
+
+    with self.assertRaises(AttributeError):
+      ip.colorfilter.create('p101')
+    with self.assertRaises(ValueError):
+      ip.colorfilter.create('med').filter(img[0:0])
+
+  def test_color_filter_histogram_blocks(self):
+    rng = np.random.RandomState(2)
+    img = rng.randint(0, 256, (61, 47, 3)).astype(np.uint8)
+    roi = img[5:53, 3:41]
+    expected = [int(val) for val in np.median(roi.reshape(-1, 3), axis=0)]
+    self.assertEqual(expected, ip.colorfilter.create('med').filter(roi))
+    block_pixels = ip.colorfilter.HISTOGRAM_BLOCK_PIXELS
+    ip.colorfilter.HISTOGRAM_BLOCK_PIXELS = 100
+    try:
+      self.assertEqual(expected, ip.colorfilter.create('med').filter(roi))
+      self.assertEqual(expected, ip.colorfilter.ChannelHistogram(roi.reshape(-1, 1, 3)).median().tolist())
+    finally:
+      ip.colorfilter.HISTOGRAM_BLOCK_PIXELS = block_pixels
+
+  def test_color_filter_single_channel(self):
+    roi = np.random.RandomState(4).randint(0, 256, (31, 17)).astype(np.uint8)
+    self.assertEqual([int(np.median(roi))], ip.colorfilter.create('med').filter(roi))
+    self.assertEqual([int(np.average(roi))], ip.colorfilter.create('avg').filter(roi))
+    self.assertEqual([int(np.median(roi))], ip.colorfilter.filter_all(roi, ['p50'])['p50'])
+
+
+class TestBatchReader(unittest.TestCase):
+  def setUp(self):
+    self.res = Resources()
+
+  def test_load_rois(self):
+    rois_json = 'rois_test.json'
+    rois_csv = 'rois_test.csv'
+    with open(rois_json, 'w') as rois_file:
+      rois_file.write('[[[1, 1], [5, 5]], [0, 2, 8, 9]]')
+    with open(rois_csv, 'w') as rois_file:
+      rois_file.write('x1,y1,x2,y2\n1,1,5,5\n0,2,8,9\n')
+
+    expected = [[[1, 1], [5, 5]], [[0, 2], [8, 9]]]
+    self.assertEqual(ip.batchreader.load_rois(rois_json), expected)
+    self.assertEqual(ip.batchreader.load_rois(rois_csv), expected)
+    os.remove(rois_json)
+    os.remove(rois_csv)
+
+    with self.assertRaises(FileNotFoundError):
+      ip.batchreader.load_rois(rois_json)
+
+  def test_batch_read(self):
+    json_filename = 'batch_test.json'
+    rois = [self.res.rect, [[0, 0], [10, 10]]]
+    batch_reader = ip.batchreader.BatchReader('hls', 'avg', rois)
+    batch_reader.read([self.res.red, self.res.green, self.res.white], json_filename)
+
+    jsd = ip.colorjson.JsonDeserializer(json_filename)
+    self.assertEqual('hls', jsd.get()['format'])
+    self.assertEqual([0, 0, 60, 60, 0, 0], jsd.get()['channels']['h'])
+    self.assertEqual([128, 128, 128, 128, 255, 255], jsd.get()['channels']['l'])
+    self.assertEqual([255, 255, 255, 255, 0, 0], jsd.get()['channels']['s'])
+    os.remove(json_filename)
+
+    with self.assertRaises(ValueError):
+      batch_reader.read([], json_filename)
+
+  def test_batch_read_parallel(self):
+    rois = [self.res.rect, [[0, 0], [100, 100]], [[50, 60], [20, 10]]]
+    batch_reader = ip.batchreader.BatchReader('yuv', 'med', rois)
+    img_filenames = ip.batchreader.expand_images(['res/test_img'])
+    self.assertEqual(9, len(img_filenames))
+    self.assertEqual(img_filenames, sorted(img_filenames))
+    self.assertEqual(
+        ip.batchreader.expand_images(['res/test_img/cat*.jpg', self.res.red]),
+        [os.path.join('res/test_img', name) for name in ['cat15.jpg', 'cat50.jpg', 'cat90.jpg']]
+        + [self.res.red])
+
+    serial_filename = 'batch_test_serial.json'
+    parallel_filename = 'batch_test_parallel.json'
+    batch_reader.read(img_filenames, serial_filename)
+    batch_reader.read(img_filenames, parallel_filename, jobs=3)
+    serial = ip.colorjson.JsonDeserializer(serial_filename).get()
+    parallel = ip.colorjson.JsonDeserializer(parallel_filename).get()
+    self.assertEqual(serial, parallel)
+    self.assertEqual(len(img_filenames) * len(rois), len(parallel['channels']['y']))
+
+    binary_filename = 'batch_test_parallel.cbin'
+    batch_reader.read(img_filenames, binary_filename, jobs=3)
+    binary = ip.colorjson.JsonDeserializer(binary_filename).get()
+    for channel in ['y', 'u', 'v']:
+      self.assertEqual(serial['channels'][channel], binary['channels'][channel].tolist())
+    del binary
+    os.remove(serial_filename)
+    os.remove(parallel_filename)
+    os.remove(binary_filename)
+
+
+  def test_batch_read_frames(self):
+    raw_filename = 'batch_frames_test.yuv'
+    json_filename = 'batch_frames_test.json'
+    frames = np.zeros((4, 24, 32), np.uint8)
+    frames[:, :16, :] = np.arange(4).reshape(4, 1, 1) * 50
+    frames[:, 16:, :] = 128
+    frames.tofile(raw_filename)
+    batch_reader = ip.batchreader.BatchReader(
+        'yuv', 'avg', [self.res.rect], 'nv12', (32, 16), slice(1, 3))
+    batch_reader.read([raw_filename], json_filename)
+    jsd = ip.colorjson.JsonDeserializer(json_filename)
+    self.assertEqual([40, 98], jsd.get()['channels']['y'])
+    os.remove(json_filename)
+    for frames in [slice(9, 10), slice(3, 1)]:
+      batch_reader = ip.batchreader.BatchReader(
+          'yuv', 'avg', [self.res.rect], 'nv12', (32, 16), frames)
+      with self.assertRaises(IndexError):
+        batch_reader.read_colors([raw_filename])
+    stdout = io.StringIO()
+    ip.server.serve_stdin(io.StringIO(json.dumps(
+        {'id': 5, 'cmd': 'sample', 'image': raw_filename, 'pixel_format': 'nv12',
+         'video_size': '32x16', 'frame': 9, 'rois': [[0, 0, 4, 4]]}) + '\n'), stdout)
+    self.assertIn('IndexError', json.loads(stdout.getvalue())['error'])
+
+    rois_json = 'batch_frames_rois.json'
+    with open(rois_json, 'w') as rois_file:
+      json.dump([[0, 0, 4, 4]], rois_file)
+    process = subprocess.run(
+        [sys.executable, 'colorscope.py', '-i', raw_filename, '-pix_fmt=nv12', '-s', '32x16',
+         '--rois', rois_json, '--frame', '5', '-o', json_filename],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=False)
+    self.assertEqual(1, process.returncode)
+    self.assertIn('Cannot read rois', process.stderr)
+    self.assertFalse(os.path.exists(json_filename))
+    os.remove(rois_json)
+    os.remove(raw_filename)
+
 
 class TestGraph(unittest.TestCase):
   def setUp(self):
@@ -549,6 +797,99 @@ class TestGraph(unittest.TestCase):
     self.assertEqual(ip.graph.Const.get_max_lightness(), 255)
     self.assertEqual(ip.graph.Const.Symbols.delta(), '\u0394')
 
+  def test_hs_background(self):
+    lightness = ip.graph.Const.get_max_lightness() // 2
+    img_hls = np.zeros((ip.graph.Const.get_max_hue(), ip.graph.Const.get_max_saturation(), 3),
+                       np.uint8)
+    for y in range(img_hls.shape[0]):
+      for x in range(img_hls.shape[1]):
+        img_hls[y, x] = [y, lightness, x]
+    expected = cv2.cvtColor(img_hls, cv2.COLOR_BGR2RGB)
+    self.assertTrue(np.array_equal(expected, ip.graph.generate_hs_background()))
+
+    background_filename = 'hs_background_cache'
+    with open(background_filename, 'w') as background_file:
+      background_file.write('broken')
+    self.assertTrue(np.array_equal(expected, ip.graph.load_hs_background(background_filename)))
+    self.assertTrue(np.array_equal(expected, np.load(background_filename)))
+    self.assertTrue(np.array_equal(expected, ip.graph.load_hs_background(background_filename)))
+    open(background_filename, 'w').close()
+    self.assertTrue(np.array_equal(expected, ip.graph.load_hs_background(background_filename)))
+    self.assertTrue(np.array_equal(expected, np.load(background_filename)))
+    os.remove(background_filename)
+
+    ip.graph.HS_BACKGROUND_CACHE.clear()
+    img = ip.graph.get_hs_background()
+    self.assertTrue(np.array_equal(expected, img))
+    self.assertIs(img, ip.graph.get_hs_background())
+    self.assertFalse(img.flags.writeable)
+    self.assertTrue(np.array_equal(expected, ip.graph.get_hs_background(background_filename)))
+    self.assertTrue(np.array_equal(expected, np.load(background_filename)))
+    os.remove(background_filename)
+
+  def test_graph_draw(self):
+    rng = np.random.RandomState(3)
+    ref_filename = 'graph_draw_ref.json'
+    cap_filename = 'graph_draw_cap.ndjson'
+    for filename in [ref_filename, cap_filename]:
+      jss = ip.colorjson.JsonSerializerHLS(filename)
+      for color in rng.randint(0, 179, (50, 3)):
+        jss.append([int(val) for val in color])
+      jss.write()
+
+    axes = plt.figure().add_subplot(1, 1, 1)
+    ip.graph.GraphHS(ref_filename, cap_filename).draw(axes)
+    line_collection, ref_scatter, cap_scatter = axes.collections
+    self.assertEqual(50, len(line_collection.get_segments()))
+    self.assertEqual(50, len(ref_scatter.get_offsets()))
+    self.assertEqual(50, len(cap_scatter.get_offsets()))
+    self.assertEqual(2, len(axes.lines))
+
+    axes = plt.figure().add_subplot(1, 1, 1)
+    ip.graph.GraphHS(ref_filename, cap_filename, density_threshold=10).draw(axes)
+    self.assertEqual(2, len(axes.collections))
+    self.assertEqual(100, sum(collection.get_array().sum() for collection in axes.collections))
+    self.assertEqual([50, 50], [collection.get_array().sum() for collection in axes.collections])
+    plt.close('all')
+    os.remove(ref_filename)
+    os.remove(cap_filename)
+
+  def test_graph_export(self):
+    json_filenames = ['graph_export_ref.json', 'graph_export_cap.cbin']
+    for filename, color in zip(json_filenames, [[10, 10, 10], [20, 20, 20]]):
+      jss = ip.colorjson.JsonSerializerHLS(filename)
+      for _ in range(3):
+        jss.append(color)
+      jss.write()
+    out_filenames = ['graph_export_0.png', 'graph_export_1.svg', 'graph_export_2.png']
+    graphs_filenames = [json_filenames + [out_filename] for out_filename in out_filenames]
+    self.assertEqual(out_filenames, ip.graph.export_graphs(graphs_filenames, jobs=2))
+    self.assertIs(ip.graph.get_export_axes(), ip.graph.get_export_axes())
+    self.assertEqual(0, len(ip.graph.get_export_axes().collections))
+    with open(out_filenames[0], 'rb') as png_file:
+      self.assertEqual(b'\x89PNG', png_file.read(4))
+    with open(out_filenames[1]) as svg_file:
+      self.assertIn('<svg', svg_file.read())
+    for out_filename in out_filenames:
+      os.remove(out_filename)
+
+    check_code = ('import sys, ip.graph; ip.graph.export_graph({!r}); '
+                  'sys.exit(any(m in sys.modules for m in {!r}))')
+    gui_modules = ['matplotlib.pyplot', 'tkinter', 'PyQt5', 'PySide2', 'gi', 'wx']
+    self.assertEqual(0, os.system(sys.executable + ' -c "' + check_code.format(
+        json_filenames + [out_filenames[0]], gui_modules) + '"'))
+    self.assertTrue(os.path.exists(out_filenames[0]))
+    os.remove(out_filenames[0])
+
+    exe = sys.executable + ' colorscope.py -gen ' + ' '.join(json_filenames)
+    self.assertEqual(0, os.system(exe + ' --gen-out ' + out_filenames[2]))
+    self.assertTrue(os.path.exists(out_filenames[2]))
+    os.remove(out_filenames[2])
+    self.assertNotEqual(0, os.system(exe + ' -gen ' + ' '.join(json_filenames)))
+    self.assertNotEqual(0, os.system(exe + ' --gen_out graph_export.invalid'))
+    for filename in json_filenames:
+      os.remove(filename)
+
 
 class TestColorJson(unittest.TestCase):
   def setUp(self):
@@ -614,6 +955,97 @@ class TestColorJson(unittest.TestCase):
     self.assertEqual([237, 253, 254], jsd.get()['channels']['s'])
     os.remove(json_filename)
 
+  def test_binary_hls(self):
+    binary_filename = 'hls_binary.cbin'
+    jss = ip.colorjson.JsonSerializerHLS(binary_filename)
+    jss.append([9, 155, 237])
+    jss.append([61, 234, 253])
+    jss.append([150, 166, 254])
+    jss.write()
+
+    with open(binary_filename, 'rb') as binary_file:
+      self.assertEqual(0, (len(binary_file.read()) - 9) % ip.colorjson.BINARY_ALIGNMENT)
+    jsd = ip.colorjson.JsonDeserializer(binary_filename)
+    self.assertEqual('hls', jsd.get()['format'])
+    self.assertEqual(['h', 'l', 's'], list(jsd.get()['channels']))
+    self.assertIsInstance(jsd.get()['channels']['h'], np.memmap)
+    self.assertEqual(np.uint8, jsd.get()['channels']['l'].dtype)
+    self.assertEqual([9, 61, 150], jsd.get()['channels']['h'].tolist())
+    self.assertEqual([155, 234, 166], jsd.get()['channels']['l'].tolist())
+    self.assertEqual([237, 253, 254], jsd.get()['channels']['s'].tolist())
+    del jsd
+    os.remove(binary_filename)
+
+  def test_binary_dtypes(self):
+    binary_filename = 'rgb_binary.CBIN'
+    for colors, dtype in [([[1.5, 2, 3]], np.float32), ([[300, -1, 3]], np.int32), ([], np.uint8)]:
+      jss = ip.colorjson.JsonSerializerRGB(binary_filename)
+      for color in colors:
+        jss.append(color)
+      jss.write()
+      channels = ip.colorjson.JsonDeserializer(binary_filename).get()['channels']
+      self.assertEqual(dtype, channels['r'].dtype)
+      self.assertEqual([color[2] for color in colors], channels['b'].tolist())
+      del channels
+    os.remove(binary_filename)
+
+  def test_ndjson_stream(self):
+    ndjson_filename = 'hls_stream.ndjson'
+    jss = ip.colorjson.JsonSerializerHLS(ndjson_filename)
+    jss.append([9, 155, 237])
+    jss.append(np.array([61, 234, 253], np.uint8))
+    jss.flush()
+    with open(ndjson_filename) as ndjson_file:
+      lines = ndjson_file.read().splitlines()
+    self.assertEqual({'format': 'hls', 'channels': ['h', 'l', 's']}, json.loads(lines[0]))
+    self.assertEqual([[9, 155, 237], [61, 234, 253]], [json.loads(line) for line in lines[1:]])
+    jss.append([150, 166, 254])
+    jss.write()
+
+    jsd = ip.colorjson.JsonDeserializer(ndjson_filename)
+    self.assertEqual('hls', jsd.get_format())
+    self.assertEqual([9, 61, 150], jsd.get()['channels']['h'])
+    self.assertEqual([237, 253, 254], jsd.get()['channels']['s'])
+    records = jsd.iter_records()
+    self.assertEqual([9, 155, 237], next(records))
+    chunks = list(jsd.iter_chunks(2))
+    self.assertEqual([2, 1], [len(chunk['channels']['l']) for chunk in chunks])
+    self.assertEqual([166], chunks[1]['channels']['l'].tolist())
+    os.remove(ndjson_filename)
+
+  def test_channel_order(self):
+    json_filename = 'hls_order.json'
+    with open(json_filename, 'w') as json_file:
+      json.dump({'format': 'hls', 'channels': {'s': [3, 6], 'h': [1, 4], 'l': [2, 5]}}, json_file)
+    jsd = ip.colorjson.JsonDeserializer(json_filename)
+    self.assertEqual([(1, 2, 3), (4, 5, 6)], list(jsd.iter_records()))
+    binary_filename = 'hls_order.cbin'
+    ip.colorjson.write_binary(binary_filename, jsd.get())
+    self.assertEqual([(1, 2, 3), (4, 5, 6)],
+                     [tuple(record) for record in
+                      ip.colorjson.JsonDeserializer(binary_filename).iter_records()])
+    with open(binary_filename, 'rb') as binary_file:
+      self.assertEqual(['h', 'l', 's'], json.loads(binary_file.readline().decode())['channels'])
+    os.remove(json_filename)
+    os.remove(binary_filename)
+
+  def test_ndjson_periodic_flush(self):
+    ndjson_filename = 'rgb_stream.ndjson'
+    jss = ip.colorjson.JsonSerializerRGB(ndjson_filename)
+    jss.append([1, 2, 3])
+    self.assertEqual('rgb', ip.colorjson.JsonDeserializer(ndjson_filename).get_format())
+    self.assertEqual(0, len(list(ip.colorjson.JsonDeserializer(ndjson_filename).iter_records())))
+    for i in range(999):
+      jss.append([i % 256, 2, 3])
+    self.assertEqual(1000, len(list(ip.colorjson.JsonDeserializer(ndjson_filename).iter_records())))
+    jss.append([4, 5, 6])
+    sleep(1.5)
+    records = list(ip.colorjson.JsonDeserializer(ndjson_filename).iter_records())
+    self.assertEqual(1001, len(records))
+    self.assertEqual([4, 5, 6], list(records[-1]))
+    jss.write()
+    os.remove(ndjson_filename)
+
 
 class TestColorMeter(unittest.TestCase):
   def setUp(self):
@@ -647,6 +1079,113 @@ class TestColorMeter(unittest.TestCase):
     os.remove(ref_filename)
     os.remove(cap_filename)
 
+  def test_colormeter_stream(self):
+    rng = np.random.RandomState(5)
+    ref_colors = rng.randint(0, 4, (200, 3))
+    cap_colors = rng.randint(0, 256, (200, 3))
+    results = []
+    for ext in ['.json', '.ndjson', '.cbin']:
+      ref_filename = 'color_meter_stream_ref' + ext
+      cap_filename = 'color_meter_stream_cap' + ext
+      for filename, colors in [(ref_filename, ref_colors), (cap_filename, cap_colors)]:
+        jss = ip.colorjson.JsonSerializerHLS(filename)
+        for color in colors:
+          jss.append([int(val) for val in color])
+        jss.write()
+      color_meter = ip.colormeter.ColorMeter(ip.colorjson.JsonDeserializer(ref_filename),
+                                             ip.colorjson.JsonDeserializer(cap_filename))
+      results.append(color_meter.get_hls_delta_perc())
+      self.assertEqual(200, color_meter.get_hls_delta_stats()['count'])
+      os.remove(ref_filename)
+      os.remove(cap_filename)
+    ref, cap = ref_colors.astype(float), cap_colors.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      expected = np.where(ref == 0, 0, cap * 100.0 / ref).mean(axis=0)
+    for result in results:
+      self.assertTrue(np.allclose(expected, result))
+
+  def test_colormeter_stats(self):
+    accumulator = ip.colormeter.HLSDeltaAccumulator()
+    accumulator.append([[0, 10, 0], [170, 20, 50]], [[179, 20, 0], [5, 20, 40]])
+    stats = accumulator.get_stats()
+    self.assertEqual(2, stats['count'])
+    self.assertAlmostEqual(14.0, stats['h']['mean'])
+    self.assertAlmostEqual(30.0, stats['h']['max'])
+    self.assertAlmostEqual(np.degrees(np.sqrt(-2 * np.log(np.cos(np.radians(16))))), stats['h']['std'])
+    self.assertEqual({'mean': 5.0, 'std': 5.0, 'max': 10.0}, stats['l'])
+    self.assertEqual({'mean': -5.0, 'std': 5.0, 'max': 10.0}, stats['s'])
+    self.assertTrue(np.allclose([500.0 / 170 / 2, 150.0, 40.0], accumulator.get_delta_perc_average()))
+
+    rng = np.random.RandomState(7)
+    ref, cap = rng.randint(0, 180, (1000, 3)), rng.randint(0, 180, (1000, 3))
+    whole = ip.colormeter.HLSDeltaAccumulator()
+    whole.append(ref, cap)
+    chunked = ip.colormeter.HLSDeltaAccumulator()
+    for start in range(0, 1000, 300):
+      chunked.append(ref[start:start + 300], cap[start:start + 300])
+    self.assertTrue(np.allclose(whole.get_delta_perc_average(), chunked.get_delta_perc_average()))
+    for channel in 'hls':
+      for key in ['mean', 'std', 'max']:
+        self.assertAlmostEqual(whole.get_stats()[channel][key], chunked.get_stats()[channel][key])
+    as_float = ip.colormeter.HLSDeltaAccumulator()
+    as_float.append(ref.astype(float), cap.astype(np.float32))
+    self.assertTrue(np.allclose(whole.get_delta_perc_average(), as_float.get_delta_perc_average()))
+    for channel in 'hls':
+      for key in ['mean', 'std', 'max']:
+        self.assertAlmostEqual(whole.get_stats()[channel][key], as_float.get_stats()[channel][key])
+    with self.assertRaises(ValueError):
+      ip.colormeter.HLSDeltaAccumulator().get_stats()
+
+  def test_delta_e(self):
+    lab_ref = [[50.0, 2.6772, -79.7751], [50.0, 3.1571, -77.2803], [50.0, 0.0, 0.0],
+               [50.0, 2.5, 0.0], [2.0776, 0.0795, -1.135]]
+    lab_cap = [[50.0, 0.0, -82.7485], [50.0, 0.0, -82.7485], [50.0, -1.0, 2.0],
+               [73.0, 25.0, -18.0], [0.9033, -0.0636, -0.5514]]
+    self.assertTrue(np.allclose([2.0425, 2.8615, 2.3669, 27.1492, 0.9082],
+                                ip.colormeter.get_delta_e(lab_ref, lab_cap), atol=1e-4))
+    self.assertTrue(np.allclose(np.linalg.norm(np.subtract(lab_cap, lab_ref), axis=1),
+                                ip.colormeter.get_delta_e(lab_ref, lab_cap, '76')))
+    self.assertTrue(np.allclose(0, ip.colormeter.get_delta_e(lab_ref, lab_ref, '94')))
+    with self.assertRaises(AttributeError):
+      ip.colormeter.get_delta_e(lab_ref, lab_cap, '2001')
+
+    lab = ip.colormeter.to_lab([[255, 255, 255], [0, 0, 0], [255, 0, 0]], 'rgb')
+    self.assertTrue(np.allclose([[100, 0, 0], [0, 0, 0], [53.24, 80.09, 67.20]], lab, atol=1e-2))
+    self.assertTrue(np.allclose(lab[:2], ip.colormeter.to_lab([[0, 255, 0], [0, 0, 0]], 'hls'),
+                                atol=1e-2))
+    with self.assertRaises(AttributeError):
+      ip.colormeter.to_lab([[0, 0, 0]], 'lab')
+
+    ref_filename = 'color_meter_delta_e_ref.json'
+    cap_filename = 'color_meter_delta_e_cap.ndjson'
+    for jss, colors in [(ip.colorjson.JsonSerializerRGB(ref_filename), [[255, 0, 0], [10, 20, 30]]),
+                        (ip.colorjson.JsonSerializerHLS(cap_filename), [[0, 128, 255], [0, 0, 0]])]:
+      for color in colors:
+        jss.append(color)
+      jss.write()
+    color_meter = ip.colormeter.ColorMeter(ip.colorjson.JsonDeserializer(ref_filename),
+                                           ip.colorjson.JsonDeserializer(cap_filename))
+    expected = ip.colormeter.get_delta_e(
+        ip.colormeter.to_lab([[255, 0, 0], [10, 20, 30]], 'rgb'),
+        ip.colormeter.to_lab([[0, 128, 255], [0, 0, 0]], 'hls'), '94')
+    self.assertTrue(np.allclose(expected, color_meter.get_delta_e('94')))
+    os.remove(ref_filename)
+    os.remove(cap_filename)
+
+  def test_delta_e_map(self):
+    rng = np.random.RandomState(11)
+    img_ref = rng.randint(0, 256, (37, 21, 3)).astype(np.uint8)
+    img_cap = rng.randint(0, 256, (37, 21, 3)).astype(np.uint8)
+    self.assertEqual(0, ip.colormeter.get_delta_e_map(img_ref, img_ref).max())
+    delta_e_map = ip.colormeter.get_delta_e_map(img_ref, img_cap, '2000', band_rows=8)
+    self.assertEqual((37, 21), delta_e_map.shape)
+    self.assertEqual(np.float32, delta_e_map.dtype)
+    expected = ip.colormeter.get_delta_e(ip.colormeter.bgr_to_lab(img_ref),
+                                         ip.colormeter.bgr_to_lab(img_cap))
+    self.assertTrue(np.allclose(expected, delta_e_map, atol=1e-3))
+    with self.assertRaises(AttributeError):
+      ip.colormeter.get_delta_e_map(img_ref, img_cap[1:])
+
   def test_colormeter_failed(self):
     ref_yuv_filename = 'color_meter_failed_yuv_ref_json.json'
     cap_yuv_filename = 'color_meter_failed_yuv_cap_json.json'
@@ -837,6 +1376,53 @@ class TestColorscope(unittest.TestCase):
   def setUp(self):
     self.res = Resources()
 
+  def test_compare_json_identical(self):
+    def strict_loads(text):
+      return json.loads(text, parse_constant=lambda name: self.fail(name + ' in json'))
+
+    img_filename = 'res/test_img/lena.png'
+    result = colorscope.process_compare(ip.imgloader.create(img_filename),
+                                        ip.imgloader.create(img_filename), 'psnr,mse', '')
+    self.assertEqual({'psnr': None, 'mse': 0.0}, strict_loads(result))
+    output = subprocess.check_output(
+        [sys.executable, 'colorscope.py', '-cpref', 'psnr,mse', img_filename, img_filename],
+        universal_newlines=True)
+    self.assertEqual({'psnr': None, 'mse': 0.0}, strict_loads(output.split('\t')[1]))
+    stdout = io.StringIO()
+    ip.server.serve_stdin(io.StringIO(json.dumps(
+        {'id': 1, 'cmd': 'compare', 'metric': 'psnr', 'ref': img_filename,
+         'cap': img_filename}) + '\n'), stdout)
+    self.assertEqual({'id': 1, 'result': None}, strict_loads(stdout.getvalue()))
+
+  def test_compare_frame_out_of_range(self):
+    img_filename = 'res/test_img/lena.png'
+    for compare_args in [['-cp', 'psnr', img_filename, img_filename],
+                         ['-scp', 'psnr', '0', img_filename, img_filename],
+                         ['-cpref', 'psnr', img_filename, img_filename],
+                         ['-cp', 'psnr', img_filename, img_filename, '--block_map', 'x.npy']]:
+      process = subprocess.run([sys.executable, 'colorscope.py', '--frame', '2'] + compare_args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, check=False)
+      self.assertEqual(1, process.returncode)
+      self.assertIn('out of range', process.stderr)
+      self.assertNotIn('Traceback', process.stderr)
+
+  def test_peak_memory(self):
+    img_filename = 'res/test_img/lena.png'
+    process = subprocess.run(
+        [sys.executable, 'colorscope.py', '-cp', 'psnr,mse', img_filename, img_filename,
+         '--peak_memory'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    self.assertEqual('peak_memory\t' + str(512 * 512 * 3 * 4), process.stderr.strip())
+    image_ref = np.zeros((4, 8, 3), np.uint8)
+    ip.qualitymeasurement.QualityMeasurementMSE.measure(image_ref, image_ref)
+    self.assertGreaterEqual(ip.qualitymeasurement.get_square_error_peak_bytes(), 4 * 8 * 3 * 4)
+
+  def test_lazy_imports(self):
+    check_code = 'import sys, colorscope; sys.exit(any(m in sys.modules for m in {!r}))'
+    heavy_modules = ['matplotlib', 'skimage']
+    self.assertEqual(0, os.system(sys.executable + ' -c "' + check_code.format(heavy_modules) + '"'))
+
   def test_main_function(self):
     exe = ''
     if is_windows():
@@ -853,10 +1439,21 @@ class TestColorscope(unittest.TestCase):
     self.assertNotEqual(0, os.system(exe + ' colorscope.py --imgfile \
         red.png --output_format=invalid'))
     self.assertNotEqual(0, os.system(exe + ' colorscope.py --imgfile '))
+    self.assertNotEqual(0, os.system(exe + ' colorscope.py -i red.png --rois invalid.json'))
+    self.assertNotEqual(0, os.system(exe + ' colorscope.py -i red.png blue.png'))
     self.assertEqual(0,os.system(exe + ' colorscope.py -cp ssim  res/test_img/lena.png res/test_img/lena50.jpg'))
     self.assertEqual(0,os.system(exe + ' colorscope.py -scp ssim 0 res/test_img/lena.png res/test_img/lena50.jpg '))
     self.assertEqual(0,os.system(exe + ' colorscope.py -cp psnr res/test_img/lena.png res/test_img/lena50.jpg'))
     self.assertEqual(0,os.system(exe + ' colorscope.py -scp psnr 0 res/test_img/lena.png  res/test_img/lena50.jpg'))
+    self.assertEqual(0,os.system(exe + ' colorscope.py -cp psnr,ssim,mse res/test_img/lena.png res/test_img/lena50.jpg'))
+    self.assertEqual(0,os.system(exe + ' colorscope.py -cpref psnr,ssim res/test_img/lena.png res/test_img/lena15.jpg res/test_img/lena50.jpg'))
+    self.assertNotEqual(0,os.system(exe + ' colorscope.py -cpref psnr res/test_img/lena.png'))
+    self.assertEqual(0,os.system(exe + ' colorscope.py -cp psnr res/test_img/lena.png res/test_img/lena15.jpg --block_map test_block_map.npy --worst 3'))
+    self.assertTrue(os.path.exists('test_block_map.npy'))
+    os.remove('test_block_map.npy')
+    self.assertEqual(0,os.system('echo \'{"cmd": "shutdown"}\' | ' + exe + ' colorscope.py --serve'))
+    self.assertEqual(0,os.system(exe + ' colorscope.py -cp ssim-tiled res/test_img/lena.png res/test_img/lena50.jpg --tile 128 -j 2'))
+    self.assertNotEqual(0,os.system(exe + ' colorscope.py -cp psnr,psnr res/test_img/lena.png res/test_img/lena50.jpg'))
 
 class TestQualitymeasures(unittest.TestCase):
   img_res_id = 'res/test_img/'
@@ -946,5 +1543,316 @@ class TestQualitymeasures(unittest.TestCase):
     self.assertAlmostEqual(psnr15_green, 30.074, delta=0.1)
     self.assertAlmostEqual(psnr15_red, 29.4835, delta=0.25)
 
+  def test_psnr_sequence(self):
+    ref_filename = 'sequence_ref_test.yuv'
+    cap_filename = 'sequence_cap_test.yuv'
+    rand = np.random.RandomState(0)
+    frames_ref = rand.randint(16, 240, (5, 24, 32), np.uint8)
+    frames_cap = frames_ref.copy()
+    frames_cap[1:] += rand.randint(0, 3, (4, 24, 32), np.uint8)
+    frames_cap[3] += rand.randint(0, 12, (24, 32), np.uint8)
+    frames_ref.tofile(ref_filename)
+    frames_cap.tofile(cap_filename)
+    image_loader_ref = ip.imgloader.create(ref_filename, 'nv12', (32, 16))
+    image_loader_cap = ip.imgloader.create(cap_filename, 'nv12', (32, 16))
+
+    sequence = ip.qualitymeasurement.QualityMeasurementSequence(
+        image_loader_ref, image_loader_cap, 'psnr')
+    frame_values = list(sequence.process_frames())
+    self.assertEqual([0, 1, 2, 3, 4], [frame_idx for frame_idx, value in frame_values])
+    for frame_idx, value in frame_values:
+      image_loader_ref.seek(frame_idx)
+      image_loader_cap.seek(frame_idx)
+      psnr = ip.qualitymeasurement.QualityMeasurement\
+             .create(image_loader_ref, image_loader_cap, 'psnr').process()
+      self.assertEqual(psnr, value)
+
+    stats = sequence.process()
+    self.assertEqual(5, stats['frames'])
+    self.assertEqual(3, stats['worst_frame'])
+    self.assertEqual(frame_values[3][1], stats['min'])
+    self.assertAlmostEqual(np.mean([value for _, value in frame_values[1:]]), stats['mean'])
+    self.assertEqual(1, stats['infinite_frames'])
+
+    summary = ip.qualitymeasurement.SequenceSummary()
+    summary.append(0, [inf, 40.0])
+    summary.append(1, [inf, 30.0])
+    self.assertEqual([inf, 35.0], summary.get()['mean'])
+    with self.assertRaises(ValueError):
+      ip.qualitymeasurement.SequenceSummary().get()
+    exe = sys.executable + ' colorscope.py -cp psnr {} nv12 32x16 {} nv12 32x16 --frames '.format(
+        ref_filename, cap_filename)
+    self.assertEqual(0, os.system(exe + '0:5'))
+    self.assertEqual(256, os.system(exe + '3:1'))
+
+    stats = ip.qualitymeasurement.QualityMeasurementSequence(
+        image_loader_ref, image_loader_cap, 'ssim-sc', slice(1, 3)).process(0)
+    self.assertEqual(2, stats['frames'])
+    self.assertIn(stats['worst_frame'], [1, 2])
+
+    self.assertEqual(frame_values, list(sequence.process_frames(jobs=2)))
+    sequence = ip.qualitymeasurement.QualityMeasurementSequence(
+        image_loader_ref, image_loader_cap, 'ssim-sc', slice(1, 5))
+    self.assertEqual(list(sequence.process_frames(1)), list(sequence.process_frames(1, jobs=3)))
+
+    del image_loader_ref, image_loader_cap, sequence
+    os.remove(ref_filename)
+    os.remove(cap_filename)
+
+  def test_yuv_planes(self):
+    raw_filename = 'planes_test.yuv'
+    rand = np.random.RandomState(0)
+    frame = rand.randint(0, 256, (24, 32), np.uint8)
+    frame.tofile(raw_filename)
+    for pixel_format in ['nv12', 'nv21', 'i420']:
+      image_loader = ip.imgloader.create(raw_filename, pixel_format, (32, 16))
+      plane_y, plane_u, plane_v = image_loader.get_planes()
+      self.assertEqual((16, 32), plane_y.shape)
+      self.assertEqual((8, 16), plane_u.shape)
+      self.assertEqual((8, 16), plane_v.shape)
+      self.assertFalse(plane_u.flags['OWNDATA'])
+      img_i420 = np.concatenate([plane.ravel() for plane in [plane_y, plane_u, plane_v]])
+      self.assertTrue(np.array_equal(
+          cv2.cvtColor(img_i420.reshape(24, 32), cv2.COLOR_YUV2BGR_I420), image_loader.imread()))
+
+      img_yuv = image_loader.get_native_channels()
+      self.assertTrue(np.array_equal(plane_y, img_yuv[:, :, 0]))
+      self.assertTrue(np.array_equal(plane_v, img_yuv[1::2, 1::2, 2]))
+      del image_loader, plane_y, plane_u, plane_v
+    os.remove(raw_filename)
+
+  def test_psnr_yuv(self):
+    image_loader_ref = ip.imgloader.create(self.dir_ref_lena)
+    image_loader_cap50 = ip.imgloader.create(self.dir_cap_lena50)
+    psnr_y, psnr_u, psnr_v, psnr_yuv = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap50, 'psnr-yuv').process()
+    psnr_sc = ip.qualitymeasurement.QualityMeasurementPSNRsingleChannel\
+        .measure(cv2.cvtColor(image_loader_ref.imread(), cv2.COLOR_BGR2YUV),
+                 cv2.cvtColor(image_loader_cap50.imread(), cv2.COLOR_BGR2YUV),
+                 ip.qualitymeasurement.ChannelsYUV.U)
+    self.assertAlmostEqual(psnr_sc, psnr_u)
+    self.assertAlmostEqual((6 * psnr_y + psnr_u + psnr_v) / 8, psnr_yuv)
+
+    ssim_values = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap50, 'ssim-yuv').process()
+    self.assertEqual(4, len(ssim_values))
+    self.assertTrue(0 < min(ssim_values) <= max(ssim_values) < 1)
+
+  def test_square_error_kernel(self):
+    rng = np.random.RandomState(3)
+    image_ref = rng.randint(0, 256, (37, 29, 3)).astype(np.uint8)
+    image_cap = rng.randint(0, 256, (37, 29, 3)).astype(np.uint8)
+    square_error = np.square(image_ref.astype(float) - image_cap.astype(float))
+    kernel = ip.qualitymeasurement.SquareErrorKernel(block_size=100)
+    self.assertEqual(square_error.sum(axis=(0, 1)).tolist(),
+                     kernel.channel_sums(image_ref, image_cap).tolist())
+    self.assertAlmostEqual(square_error[:, :, 2].mean(),
+                           kernel.mean(image_ref[:, :, 2], image_cap[:, :, 2]))
+    self.assertAlmostEqual(square_error.mean(), kernel.mean(image_ref, image_cap))
+    self.assertEqual(3 * 29 * 4, kernel.get_peak_bytes())
+
+    kernel_float = ip.qualitymeasurement.SquareErrorKernel()
+    self.assertAlmostEqual(square_error.mean(),
+                           kernel_float.mean(image_ref.astype(float), image_cap))
+
+    image_ref = np.zeros((2160, 3840, 3), np.uint8)
+    image_cap = np.full((2160, 3840, 3), 2, np.uint8)
+    tracemalloc.start()
+    mean_square_error = ip.qualitymeasurement.SquareErrorKernel().mean(image_ref, image_cap)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    self.assertEqual(4.0, mean_square_error)
+    self.assertLess(peak_bytes, 8 << 20)
+
+  def test_ssim_tiled(self):
+    image_ref = ip.imgloader.create(self.dir_ref_lena).get_native_channels()
+    image_cap = ip.imgloader.create(self.dir_cap_lena50).get_native_channels()
+    ssim_value = ip.qualitymeasurement.QualityMeasurementSSIM.measure(image_ref, image_cap)
+    for tile_size, jobs in [(512, 1), (61, 1), (100, 3)]:
+      ssim_tiled = ip.qualitymeasurement.QualityMeasurementSSIMtiled\
+          .measure(image_ref, image_cap, tile_size, jobs)
+      self.assertAlmostEqual(ssim_value, ssim_tiled, places=10)
+    ssim_sc = ip.qualitymeasurement.QualityMeasurementSSIMsingleChannel\
+        .measure(image_ref, image_cap, 2)
+    ssim_tiled_sc = ip.qualitymeasurement.QualityMeasurementSSIMtiledSingleChannel\
+        .measure(image_ref, image_cap, 2, 77)
+    self.assertAlmostEqual(ssim_sc, ssim_tiled_sc, places=10)
+
+    kernel = ip.qualitymeasurement.SSIMTiledKernel(100)
+    self.assertEqual([(3, 103, 3, 103), (3, 103, 103, 117), (103, 117, 3, 103), (103, 117, 103, 117)],
+                     kernel.get_tiles(120, 120))
+    with self.assertRaises(ValueError):
+      kernel.mean(image_ref[:6], image_cap[:6])
+
+  def test_reference_context(self):
+    image_loader_ref = ip.imgloader.create(self.dir_ref_lena)
+    reference = ip.qualitymeasurement.ReferenceContext(image_loader_ref)
+    for dir_cap in [self.dir_cap_lena15, self.dir_cap_lena90]:
+      image_loader_cap = ip.imgloader.create(dir_cap)
+      for method, args in [('ssim', ()), ('ssim-sc', (2,)), ('psnr', ()), ('psnr-yuv', ())]:
+        value = ip.qualitymeasurement.QualityMeasurement\
+            .create(image_loader_ref, image_loader_cap, method).process(*args)
+        self.assertTrue(np.allclose(value, reference.process(image_loader_cap, method, *args)),
+                        method)
+      values = reference.process(image_loader_cap, 'mse,ssim')
+      self.assertEqual(['mse', 'ssim'], list(values))
+    self.assertIs(reference.get_ssim_moments(), reference.get_ssim_moments())
+
+  def test_block_map(self):
+    image_loader_ref = ip.imgloader.create(self.dir_ref_lena)
+    image_loader_cap = ip.imgloader.create(self.dir_cap_lena15)
+    blocks = ip.qualitymeasurement.QualityMeasurementBlocks(image_loader_ref, image_loader_cap, 16)
+    mse_map = blocks.process('mse')
+    self.assertEqual((32, 32), mse_map.shape)
+    mse = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap, 'mse').process()
+    self.assertAlmostEqual(mse, mse_map.mean())
+    block_error = np.square(image_loader_ref.imread()[32:48, 80:96].astype(float) -
+                            image_loader_cap.imread()[32:48, 80:96].astype(float)).mean()
+    self.assertAlmostEqual(block_error, mse_map[2, 5])
+    self.assertTrue(np.allclose(10 * np.log10(255.0 ** 2 / mse_map), blocks.process('psnr')))
+
+    ssim_map = blocks.process('ssim')
+    self.assertTrue(np.all(ssim_map <= 1))
+    worst = blocks.get_worst_blocks(ssim_map, 3, 'ssim')
+    self.assertEqual(3, len(worst))
+    self.assertAlmostEqual(ssim_map.min(), worst[0][2])
+    self.assertEqual(ssim_map.min(), ssim_map[worst[0][1] // 16, worst[0][0] // 16])
+    self.assertTrue(worst[0][2] <= worst[1][2] <= worst[2][2])
+    self.assertAlmostEqual(mse_map.max(), blocks.get_worst_blocks(mse_map, 1, 'mse')[0][2])
+
+    blocks_partial = ip.qualitymeasurement.QualityMeasurementBlocks(
+        image_loader_ref, image_loader_cap, 100)
+    self.assertEqual((6, 6), blocks_partial.process('mse').shape)
+    self.assertEqual([], blocks.get_worst_blocks(mse_map, 0, 'mse'))
+
+    blocks.write(ssim_map, 'test_block_map.npy')
+    self.assertTrue(np.array_equal(ssim_map, np.load('test_block_map.npy')))
+    os.remove('test_block_map.npy')
+    blocks.write(blocks.process('psnr'), 'test_block_map.png')
+    self.assertEqual((512, 512, 3), cv2.imread('test_block_map.png').shape)
+    os.remove('test_block_map.png')
+    with self.assertRaises(ValueError):
+      blocks.write(ssim_map, 'test_block_map.txt')
+    with self.assertRaises(AttributeError):
+      blocks.process('psnr-yuv')
+
+  def test_multi_metric(self):
+    image_loader_ref = ip.imgloader.create(self.dir_ref_lena)
+    image_loader_cap50 = ip.imgloader.create(self.dir_cap_lena50)
+    values = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap50, 'psnr,ssim,mse,psnr-yuv').process()
+    self.assertEqual(['psnr', 'ssim', 'mse', 'psnr-yuv'], list(values))
+    for method in values:
+      single = ip.qualitymeasurement.QualityMeasurement\
+          .create(image_loader_ref, image_loader_cap50, method).process()
+      self.assertTrue(np.allclose(single, values[method]), method)
+    self.assertAlmostEqual(values['psnr'], ip.qualitymeasurement.get_psnr(values['mse']))
+
+    values_sc = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap50, 'psnr-sc,mse-sc').process(1)
+    psnr_sc = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap50, 'psnr-sc').process(1)
+    self.assertAlmostEqual(psnr_sc, values_sc['psnr-sc'])
+    self.assertAlmostEqual(values_sc['psnr-sc'], ip.qualitymeasurement.get_psnr(values_sc['mse-sc']))
+
+class TestServer(unittest.TestCase):
+  compare_job = {'id': 1, 'cmd': 'compare', 'metric': 'psnr,mse',
+                 'ref': 'res/test_img/lena.png', 'cap': 'res/test_img/lena50.jpg'}
+  sample_job = {'id': 2, 'cmd': 'sample', 'image': 'res/test_img/lena.png',
+                'rois': [[10, 10, 50, 50]], 'format': 'hls', 'filter': 'med'}
+
+  def get_responses(self, lines, jobs=2):
+    stdout = io.StringIO()
+    ip.server.serve_stdin(io.StringIO('\n'.join(lines) + '\n'), stdout, jobs)
+    responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    return {response['id']: response for response in responses}
+
+  def test_serve_stdin(self):
+    responses = self.get_responses([
+        json.dumps(self.compare_job),
+        json.dumps(self.sample_job),
+        json.dumps({'id': 3, 'cmd': 'compare', 'metric': 'psnr', 'channel': 2,
+                    'ref': 'res/test_img/lena.png', 'cap': 'res/test_img/lena50.jpg'}),
+        json.dumps({'id': 4, 'cmd': 'compare', 'metric': 'psnr', 'ref': 'res/test_img/lena.png'}),
+        json.dumps({'id': 5, 'cmd': 'unknown'}),
+        'not json'
+    ])
+    image_loader_ref = ip.imgloader.create('res/test_img/lena.png')
+    image_loader_cap = ip.imgloader.create('res/test_img/lena50.jpg')
+    psnr = ip.qualitymeasurement.QualityMeasurement\
+        .create(image_loader_ref, image_loader_cap, 'psnr').process()
+    self.assertAlmostEqual(psnr, responses[1]['result']['psnr'])
+    self.assertIn('mse', responses[1]['result'])
+    color_reader = ip.colorreader.ColorReaderHLS(image_loader_ref, '', 'med')
+    self.assertEqual([color_reader.read_rect_color([[10, 10], [50, 50]])], responses[2]['result'])
+    self.assertIn('result', responses[3])
+    self.assertIn('KeyError', responses[4]['error'])
+    self.assertIn('error', responses[5])
+    self.assertIn('error', responses[None])
+
+  def test_serve_job_exception(self):
+    raw_filename = 'serve_odd_width.yuv'
+    with open(raw_filename, 'wb') as raw_file:
+      raw_file.write(bytes(31 * 48 * 3 // 2))
+    responses = self.get_responses([
+        json.dumps({'id': 1, 'cmd': 'sample', 'image': raw_filename, 'pixel_format': 'nv12',
+                    'video_size': '31x48', 'rois': [[0, 0, 4, 4]]}),
+        json.dumps(self.sample_job)
+    ])
+    os.remove(raw_filename)
+    self.assertIn('error', responses[1])
+    self.assertIn('result', responses[2])
+
+  def test_serve_sigterm(self):
+    server = subprocess.Popen([sys.executable, 'colorscope.py', '--serve'],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    server.stdin.write(json.dumps(self.sample_job) + '\n')
+    server.stdin.flush()
+    self.assertEqual(2, json.loads(server.stdout.readline())['id'])
+    server.send_signal(signal.SIGTERM)
+    self.assertEqual(0, server.wait(10))
+    server.stdin.close()
+    server.stdout.close()
+
+  def test_serve_shutdown(self):
+    responses = self.get_responses([
+        json.dumps(self.sample_job),
+        json.dumps({'id': 'stop', 'cmd': 'shutdown'}),
+        json.dumps(self.compare_job)
+    ], jobs=1)
+    self.assertEqual({2, 'stop'}, set(responses))
+
+  def test_serve_stopped(self):
+    stdout = io.StringIO()
+    job_server = ip.server.JobServer(1, max_pending=1)
+    job_server.close()
+    for _ in range(2):
+      self.assertIsNone(job_server.submit(json.dumps(self.sample_job), ip.server.LineWriter(stdout)))
+    self.assertEqual([{'id': 2, 'error': 'ServerStopped: server stopped'}] * 2,
+                     [json.loads(line) for line in stdout.getvalue().splitlines()])
+
+  def test_serve_unix(self):
+    socket_filename = 'test_colorscope.sock'
+    server = threading.Thread(target=ip.server.serve_unix, args=(socket_filename, 2))
+    server.start()
+    while not os.path.exists(socket_filename):
+      sleep(0.01)
+    with socket.socket(socket.AF_UNIX) as client:
+      client.connect(socket_filename)
+      client_file = client.makefile('rw')
+      for job in [self.compare_job, self.sample_job]:
+        client_file.write(json.dumps(job) + '\n')
+      client_file.flush()
+      responses = [json.loads(client_file.readline()) for i in range(2)]
+      self.assertEqual([1, 2], sorted(response['id'] for response in responses))
+      client_file.write(json.dumps({'id': 3, 'cmd': 'shutdown'}) + '\n')
+      client_file.flush()
+      self.assertEqual({'id': 3, 'result': 'shutdown'}, json.loads(client_file.readline()))
+    server.join(10)
+    self.assertFalse(server.is_alive())
+    self.assertFalse(os.path.exists(socket_filename))
+
 if __name__ == '__main__':
   unittest.main()